@@ -0,0 +1,126 @@
+"""
+File: adaptive_concurrency.py
+Version: 1.4
+
+Description:
+Adaptive limit of the requests in flight against one host (--adaptive-concurrency), so one setting fits
+a small municipal server that falls over at 8 parallel requests as well as ArcGIS Online taking 64.
+
+The limit follows AIMD (additive increase, multiplicative decrease), like TCP congestion control:
+    - it starts at 2 and grows by one for every fast response (slow start, the limit doubles every
+      round trip) until the first sign of overload
+    - then it grows by one per round trip, i.e. by 1/limit for every fast response
+    - throttling (429, 503), timeouts and dropped connections halve it
+    - a p95 latency more than LATENCY_TOLERANCE times the usual p95 of the same endpoint kind cuts it by 20%
+and it stays between 1 and the max requests per host (--max-per-host, default --concurrency).
+
+Responses to requests sent before the last decrease do not decrease the limit again, so a burst of
+429s answering one round of requests counts once.
+"""
+
+import logging
+import threading
+
+THROTTLED = "throttled"
+OK = "ok"
+
+
+class AdaptiveLimit:
+
+    INITIAL = 2
+    BACKOFF = 0.5
+    LATENCY_BACKOFF = 0.8
+    # p95 latency over this many times the baseline of the endpoint kind is a sign of overload
+    LATENCY_TOLERANCE = 2.0
+    # ... unless it is less than this many seconds slower, noise on a fast local server
+    LATENCY_MIN_RISE = 0.025
+    # responses per latency window, per endpoint kind
+    WINDOW = 20
+    # how fast the baseline follows a p95 latency higher than itself, per window, so a server that got
+    # slower for good is not taken for an overloaded one forever
+    BASELINE_DRIFT = 0.05
+
+    def __init__(self, host: str, max_limit: int, min_limit: int = 1):
+        self.host = host
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(min(self.max_limit, max(self.min_limit, self.INITIAL)))
+        self.slow_start = True
+        self.in_flight = 0
+        # bumped by every decrease, requests carry the epoch they were sent in
+        self.epoch = 0
+        # latencies of the current window and p95 baseline, by endpoint kind
+        self.samples = {}
+        self.baselines = {}
+
+        self.decreases = 0
+        self.lowest = self.highest = int(self.limit)
+        self.condition = threading.Condition()
+
+    def acquire(self) -> int:
+        """wait for a free slot, returns the ticket to give back to release()"""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            return self.epoch
+
+    def release(self, ticket: int, kind: str, seconds: float, signal: str = None):
+        """
+        free the slot of a request and adapt the limit to its outcome: OK (200/304), THROTTLED (429/503, timeout,
+        dropped connection) or None for anything else, which says nothing about the load of the server
+        """
+        with self.condition:
+            busy = self.in_flight >= int(self.limit) // 2
+            self.in_flight -= 1
+            if signal == THROTTLED:
+                self.decrease(ticket, self.BACKOFF, "throttled")
+            elif signal == OK:
+                if self.latency_rising(kind, seconds):
+                    self.decrease(ticket, self.LATENCY_BACKOFF, f"p95 latency of {kind} requests rising")
+                elif busy:
+                    # a limit the crawl does not use is not raised, it would say nothing about the server
+                    self.increase()
+            # wake only the threads that can send now, not every waiting worker
+            self.condition.notify(max(0, int(self.limit) - self.in_flight))
+
+    def increase(self):
+        self.limit = min(self.max_limit, self.limit + (1 if self.slow_start else 1 / self.limit))
+        self.highest = max(self.highest, int(self.limit))
+
+    def decrease(self, ticket: int, factor: float, reason: str):
+        if ticket < self.epoch:
+            # sent at the higher limit, already accounted for by the last decrease
+            return
+        previous = int(self.limit)
+        self.epoch += 1
+        self.slow_start = False
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.decreases += 1
+        self.lowest = min(self.lowest, int(self.limit))
+        # latencies measured at the old limit
+        self.samples.clear()
+        logging.info(f"{self.host}: {reason}, concurrency limit {previous} -> {int(self.limit)}")
+
+    def latency_rising(self, kind: str, seconds: float) -> bool:
+        window = self.samples.setdefault(kind, [])
+        window.append(seconds)
+        if len(window) < self.WINDOW:
+            return False
+        window.sort()
+        p95 = window[int(0.95 * (len(window) - 1))]
+        window.clear()
+
+        baseline = self.baselines.get(kind)
+        if baseline is None or p95 <= baseline:
+            self.baselines[kind] = p95
+            return False
+        self.baselines[kind] = baseline + (p95 - baseline) * self.BASELINE_DRIFT
+        return p95 > baseline * self.LATENCY_TOLERANCE and p95 - baseline > self.LATENCY_MIN_RISE
+
+    def describe(self) -> str:
+        with self.condition:
+            return (
+                f"limit={int(self.limit)} (range {self.lowest}-{self.highest}, max {self.max_limit}), "
+                f"{self.decreases} decreases"
+            )
@@ -0,0 +1,161 @@
+"""
+File: arcgis_cache.py
+Version: 1.4
+
+Description:
+Persistent cache of ArcGIS REST responses, used to make rescans of the same server cheap.
+
+Entries are keyed by url + query parameters. Each entry is a pair of files in the cache folder:
+    <key>.body   the raw response body
+    <key>.json   url, params, ETag, Last-Modified, encoding, sha256 of the body and when it was stored
+
+An entry younger than the ttl is used without asking the server. Older entries are revalidated with a
+conditional GET (If-None-Match / If-Modified-Since), a 304 answer refreshes the entry without downloading
+the document again. evict() removes entries older than max_age, then the least recently used entries
+until the cache is below max_size.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+class ResponseCache:
+
+    def __init__(self, cache_dir: str, ttl: float = 0, max_age: float = 30 * 86400, max_size: int = 1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_size = max_size
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.stat_lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, url: str, params: dict = None) -> str:
+        params = sorted((params or {}).items())
+        return hashlib.sha256(json.dumps([url, params]).encode("utf8")).hexdigest()
+
+    def path(self, key: str, ext: str) -> str:
+        # two level fan out so a big catalog does not end up as one huge directory
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{ext}")
+
+    def lookup(self, key: str):
+        """return the metadata of a cached entry, or None when there is no usable entry"""
+        try:
+            with open(self.path(key, "json"), encoding="utf8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry: dict) -> bool:
+        return self.ttl > 0 and time.time() - entry["stored"] < self.ttl
+
+    def conditional_headers(self, entry: dict) -> dict:
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def read_body(self, key: str, entry: dict):
+        """return the cached body, or None if it is missing or does not match its content hash"""
+        try:
+            with open(self.path(key, "body"), "rb") as f:
+                body = f.read()
+        except OSError:
+            return None
+        if hashlib.sha256(body).hexdigest() != entry["sha256"]:
+            logging.warning(f"cache entry for {entry['url']} is corrupt, ignoring it")
+            return None
+        return body
+
+    def count(self, outcome: str):
+        with self.stat_lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def store(self, key: str, url: str, params: dict, headers, body: bytes, encoding: str):
+        entry = {
+            "url": url,
+            "params": params,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "encoding": encoding,
+            "sha256": hashlib.sha256(body).hexdigest(),
+            "size": len(body),
+            "stored": time.time(),
+        }
+        os.makedirs(os.path.dirname(self.path(key, "json")), exist_ok=True)
+        self.write_atomic(self.path(key, "body"), body)
+        self.write_atomic(self.path(key, "json"), json.dumps(entry).encode("utf8"))
+
+    def refresh(self, key: str, entry: dict):
+        # the server confirmed the entry is still current (304)
+        entry["stored"] = time.time()
+        self.write_atomic(self.path(key, "json"), json.dumps(entry).encode("utf8"))
+
+    def touch(self, key: str):
+        # the metadata file mtime is the last use time for eviction
+        try:
+            os.utime(self.path(key, "json"))
+        except OSError:
+            pass
+
+    def write_atomic(self, path: str, data: bytes):
+        # workers may store the same url at the same time, never leave a half written file behind
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        removed = 0
+        for folder, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if not file.endswith(".json"):
+                    continue
+                meta_path = os.path.join(folder, file)
+                body_path = meta_path[:-len(".json")] + ".body"
+                try:
+                    last_used = os.path.getmtime(meta_path)
+                    size = os.path.getsize(meta_path) + os.path.getsize(body_path)
+                except OSError:
+                    size = 0
+                    last_used = 0
+                if now - last_used > self.max_age:
+                    self.remove(meta_path, body_path)
+                    removed += 1
+                else:
+                    entries.append((last_used, size, meta_path, body_path))
+
+        # least recently used first
+        entries.sort()
+        total = sum(entry[1] for entry in entries)
+        while entries and total > self.max_size:
+            last_used, size, meta_path, body_path = entries.pop(0)
+            self.remove(meta_path, body_path)
+            removed += 1
+            total -= size
+
+        logging.info(f"Response cache: {len(entries)} entries, {total / (1024 * 1024):.1f} MB, evicted={removed}")
+
+    def remove(self, meta_path: str, body_path: str):
+        for path in (meta_path, body_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def close(self, evict: bool = True):
+        logging.info(f"Response cache: hits={self.hits} revalidated={self.revalidated} misses={self.misses}")
+        if evict:
+            self.evict()
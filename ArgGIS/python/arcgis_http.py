@@ -0,0 +1,336 @@
+"""
+File: arcgis_http.py
+Version: 1.4
+
+Description:
+HTTP access for the ArcGIS crawler. All requests made while scanning a server go through
+ArcGISClient, which owns the pooled keep-alive session and applies, per host:
+    - a limit on the number of requests in flight, fixed or adapted to the server (AdaptiveLimit)
+    - a requests-per-second limit (token bucket)
+    - retries with exponential backoff and jitter for throttling (429), server errors and
+      connection failures, honoring any Retry-After header sent by the server
+and, when a ResponseCache is given, serves and revalidates documents from the on-disk cache.
+Responses are decoded straight from bytes, with orjson when it is installed.
+Requests are recorded by endpoint kind (server, folder, service, layers, layer) in ScanMetrics, when given.
+The http exchanges can be recorded to a replay archive, or answered from one without network access.
+No request is sent past the deadline of the caller or once the ScanBudget of the scan is spent.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    # optional, several times faster than the json module on big layer documents
+    import orjson
+except ImportError:
+    orjson = None
+
+import adaptive_concurrency
+from arcgis_cache import ResponseCache
+from arcgis_replay import RecordingSession, ReplaySession
+from scan_budget import ScanBudget
+from scan_metrics import ScanMetrics
+
+
+JSON_PARSER = "orjson" if orjson is not None else "json"
+
+
+def loads(content: bytes):
+    """decode a json document straight from the response bytes, without building a str first"""
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # NaN/Infinity and other json module extensions some servers emit
+            pass
+    return json.loads(content)
+
+
+class TokenBucket:
+    """requests-per-second limiter, bursts of up to `burst` requests are allowed after an idle period"""
+
+    def __init__(self, rate: float, burst: float = 0):
+        self.rate = rate
+        self.capacity = max(1.0, burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ArcGISClient:
+
+    # responses worth another try, anything else is returned to the caller as is
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+    # responses telling an adaptive limit the server is overloaded
+    THROTTLE_STATUS = {429, 503}
+
+    def __init__(
+        self,
+        max_per_host: int = 1,
+        pool_size: int = 10,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        rate_limit: float = 0.0,
+        timeout: float = 60.0,
+        cache: ResponseCache = None,
+        metrics: ScanMetrics = None,
+        record: str = None,
+        replay: str = None,
+        budget: ScanBudget = None,
+        adaptive: bool = False,
+    ):
+        self.max_per_host = max(1, max_per_host)
+        # max_per_host is then the ceiling of the limit of each host
+        self.adaptive = adaptive
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate_limit = rate_limit
+        self.timeout = timeout
+        self.cache = cache
+        self.metrics = metrics
+        self.budget = budget
+
+        self.host_slots = {}
+        self.host_buckets = {}
+        self.slot_lock = threading.Lock()
+
+        self.decode_seconds = 0.0
+        self.stat_lock = threading.Lock()
+
+        # one keep-alive pool per host, big enough that no worker thread has to open its own connection
+        pool_size = max(pool_size, self.max_per_host)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        if replay:
+            self.session = ReplaySession(replay)
+        elif record:
+            self.session = RecordingSession(self.session, record)
+
+    def host_slot(self, url: str):
+        # one semaphore or adaptive limit per host:port, shared by every thread of the crawl
+        host = urlsplit(url).netloc
+        with self.slot_lock:
+            slot = self.host_slots.get(host)
+            if slot is None:
+                slot = adaptive_concurrency.AdaptiveLimit(host, self.max_per_host) if self.adaptive else threading.BoundedSemaphore(self.max_per_host)
+                self.host_slots[host] = slot
+        return slot
+
+    def host_limit(self, url: str) -> str:
+        """concurrency limit of the host of url, for the scan summary"""
+        if not self.adaptive:
+            return f"limit={self.max_per_host} (fixed)"
+        return self.host_slot(url).describe()
+
+    def host_bucket(self, url: str):
+        if self.rate_limit <= 0:
+            return None
+        host = urlsplit(url).netloc
+        with self.slot_lock:
+            bucket = self.host_buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.rate_limit)
+                self.host_buckets[host] = bucket
+        return bucket
+
+    def backoff_delay(self, attempt: int) -> float:
+        # exponential backoff with full jitter, so parallel workers do not retry in lock step
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def retry_after(self, r: requests.Response):
+        """seconds to wait requested by the server with a Retry-After header, or None"""
+        value = r.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+    def get(self, url: str, params: dict = None, headers: dict = None, kind: str = "other", deadline: float = None):
+        """
+        GET url, retrying throttled and failed requests. Returns the last response, or None if no response was received.
+        Nothing is sent after deadline (a time.monotonic() value) or once the scan budget is spent
+        """
+        if self.budget is not None and self.budget.deadline is not None:
+            deadline = self.budget.deadline if deadline is None else min(deadline, self.budget.deadline)
+
+        bucket = self.host_bucket(url)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+
+            timeout = self.timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logging.debug(f"deadline reached, request not sent url={url}")
+                    return None
+                timeout = min(timeout, remaining)
+            if self.budget is not None and not self.budget.spend():
+                logging.debug(f"scan budget spent, request not sent url={url}")
+                return None
+
+            try:
+                slot = self.host_slot(url)
+                ticket = slot.acquire()
+                signal = None
+                tstart = time.perf_counter()
+                try:
+                    r = self.session.get(url, params=params, headers=headers, timeout=timeout)
+                    if r.status_code in self.THROTTLE_STATUS:
+                        signal = adaptive_concurrency.THROTTLED
+                    elif r.status_code in (200, 304):
+                        signal = adaptive_concurrency.OK
+                except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                    signal = adaptive_concurrency.THROTTLED
+                    raise
+                finally:
+                    elapsed = time.perf_counter() - tstart
+                    if self.adaptive:
+                        slot.release(ticket, kind, elapsed, signal)
+                    else:
+                        slot.release()
+            except requests.exceptions.RequestException as e:
+                if self.metrics is not None:
+                    self.metrics.request(kind, elapsed, 0, error=True)
+                if attempt >= self.retries:
+                    logging.error(f"error: request failed after {attempt + 1} attempts url={url} - {e}")
+                    return None
+                delay = self.backoff_delay(attempt)
+                reason = type(e).__name__
+            else:
+                if self.metrics is not None:
+                    self.metrics.request(kind, elapsed, len(r.content), error=r.status_code not in (200, 304))
+                if r.status_code not in self.RETRY_STATUS or attempt >= self.retries:
+                    return r
+                delay = self.retry_after(r)
+                if delay is None:
+                    delay = self.backoff_delay(attempt)
+                reason = f"http {r.status_code}"
+
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                # the caller reports the service it could not read in time
+                logging.debug(f"{reason} from {url}, no time left to retry before the deadline")
+                return None
+
+            attempt += 1
+            if self.metrics is not None:
+                self.metrics.retry(kind)
+            logging.warning(f"{reason} from {url}, retry {attempt}/{self.retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+    def get_content(self, url: str, params: dict = None, log_errors: bool = True, kind: str = "other", deadline: float = None):
+        """GET url and return (body bytes, declared encoding), or None if the request failed"""
+        if self.cache is None:
+            r = self.get(url, params=params, kind=kind, deadline=deadline)
+            if r is None:
+                return None
+            if r.status_code != 200:
+                if log_errors:
+                    logging.error(f"error: {r} url={url}")
+                return None
+            return r.content, r.encoding
+
+        key = self.cache.key(url, params)
+        entry = self.cache.lookup(key)
+        headers = None
+        if entry is not None:
+            if self.cache.is_fresh(entry):
+                body = self.cache.read_body(key, entry)
+                if body is not None:
+                    self.cache.count("hits")
+                    self.cache.touch(key)
+                    if self.metrics is not None:
+                        self.metrics.cache_hit(kind)
+                    return body, entry.get("encoding")
+            headers = self.cache.conditional_headers(entry)
+
+        r = self.get(url, params=params, headers=headers, kind=kind, deadline=deadline)
+        if r is None:
+            return None
+
+        if r.status_code == 304 and entry is not None:
+            body = self.cache.read_body(key, entry)
+            if body is not None:
+                self.cache.count("revalidated")
+                self.cache.refresh(key, entry)
+                return body, entry.get("encoding")
+            # the cached body is gone, ask again without the validators
+            r = self.get(url, params=params, kind=kind, deadline=deadline)
+            if r is None:
+                return None
+
+        if r.status_code != 200:
+            if log_errors:
+                logging.error(f"error: {r} url={url}")
+            return None
+
+        self.cache.count("misses")
+        self.cache.store(key, url, params, r.headers, r.content, r.encoding)
+        return r.content, r.encoding
+
+    def get_json(self, url: str, params: dict = None, log_errors: bool = True, kind: str = "other", deadline: float = None):
+        """GET url and return the decoded json document, or None if the request failed"""
+        fetched = self.get_content(url, params=params, log_errors=log_errors, kind=kind, deadline=deadline)
+        if fetched is None:
+            return None
+        content, encoding = fetched
+
+        tstart = time.perf_counter()
+        try:
+            return loads(content)
+        except ValueError:
+            pass
+        finally:
+            elapsed = time.perf_counter() - tstart
+            with self.stat_lock:
+                self.decode_seconds += elapsed
+            if self.metrics is not None:
+                self.metrics.decode(kind, elapsed)
+
+        # not utf8 (old servers declaring another charset), decode the text the way requests would
+        try:
+            return json.loads(content.decode(encoding or "utf-8", errors="replace"))
+        except json.decoder.JSONDecodeError:
+            logging.error(f"error processing json result returned from url {url}")
+            return None
+
+    def close(self, evict: bool = True):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close(evict)
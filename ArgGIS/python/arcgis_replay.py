@@ -0,0 +1,132 @@
+"""
+File: arcgis_replay.py
+Version: 1.4
+
+Description:
+Record and replay of the http exchanges of a scan, to rerun a real crawl offline and at full CPU speed
+(profiling the json and writer path, reproducing a slow customer scan locally).
+
+The archive is a gzip compressed json lines file. The first line is a header, then one line per response:
+    url, params, status, the headers the client uses (ETag, Last-Modified, Retry-After), encoding and body
+
+RecordingSession wraps the requests session of ArcGISClient and appends every response to the archive.
+ReplaySession stands in for the session and answers from the archive without any network access. A url
+requested several times (retries, a server listed twice) gets its recorded responses in the same order,
+the last one is repeated after that.
+"""
+
+import base64
+import gzip
+import json
+import logging
+import threading
+import time
+import zlib
+from collections import deque
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+ARCHIVE_VERSION = 1
+
+# response headers ArcGISClient looks at, nothing else is recorded
+RECORDED_HEADERS = ["ETag", "Last-Modified", "Retry-After", "Content-Type"]
+
+
+def exchange_key(url: str, params: dict = None) -> str:
+    return json.dumps([url, sorted((params or {}).items())])
+
+
+class RecordingSession:
+
+    def __init__(self, session: requests.Session, archive_path: str):
+        self.session = session
+        self.archive_path = archive_path
+        self.count = 0
+        self.lock = threading.Lock()
+        self.archive = gzip.open(archive_path, "wt", encoding="utf8")
+        self.archive.write(json.dumps({"version": ARCHIVE_VERSION, "recorded": time.time()}) + "\n")
+
+    def get(self, url: str, params: dict = None, headers: dict = None, timeout: float = None):
+        r = self.session.get(url, params=params, headers=headers, timeout=timeout)
+
+        record = {
+            "url": url,
+            "params": params,
+            "status": r.status_code,
+            "headers": {name: r.headers[name] for name in RECORDED_HEADERS if name in r.headers},
+            "encoding": r.encoding,
+        }
+        # ArcGIS documents are utf8 text, anything else is kept as base64
+        try:
+            record["body"] = r.content.decode("utf8")
+        except UnicodeDecodeError:
+            record["body64"] = base64.b64encode(r.content).decode("ascii")
+
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            self.archive.write(line)
+            self.count += 1
+        return r
+
+    def close(self):
+        self.session.close()
+        with self.lock:
+            self.archive.close()
+        logging.info(f"Recorded {self.count} http exchanges to {self.archive_path}")
+
+
+class ReplaySession:
+
+    def __init__(self, archive_path: str):
+        self.archive_path = archive_path
+        self.exchanges = {}
+        self.lock = threading.Lock()
+        self.replayed = 0
+        self.missing = 0
+
+        count = 0
+        with gzip.open(archive_path, "rt", encoding="utf8") as archive:
+            try:
+                header = json.loads(archive.readline())
+                if header.get("version") != ARCHIVE_VERSION:
+                    raise ValueError(f"{archive_path} is not a version {ARCHIVE_VERSION} replay archive")
+                for line in archive:
+                    record = json.loads(line)
+                    self.exchanges.setdefault(exchange_key(record["url"], record["params"]), deque()).append(record)
+                    count += 1
+            except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError):
+                # the recording scan was killed, everything before the cut is still usable
+                logging.warning(f"replay archive {archive_path} is truncated, using the {count} exchanges before the end")
+
+        logging.info(f"Replaying {count} http exchanges from {archive_path}")
+
+    def get(self, url: str, params: dict = None, headers: dict = None, timeout: float = None):
+        with self.lock:
+            recorded = self.exchanges.get(exchange_key(url, params))
+            if recorded is None:
+                self.missing += 1
+                record = None
+            else:
+                self.replayed += 1
+                record = recorded.popleft() if len(recorded) > 1 else recorded[0]
+
+        r = requests.Response()
+        r.url = url
+        if record is None:
+            logging.warning(f"not in replay archive: {url} {params or ''}")
+            r.status_code = 404
+            r._content = b""
+            return r
+
+        r.status_code = record["status"]
+        r.headers = CaseInsensitiveDict(record["headers"])
+        r.encoding = record["encoding"]
+        if "body64" in record:
+            r._content = base64.b64decode(record["body64"])
+        else:
+            r._content = record["body"].encode("utf8")
+        return r
+
+    def close(self):
+        logging.info(f"Replay: {self.replayed} responses replayed, {self.missing} requests not in the archive")
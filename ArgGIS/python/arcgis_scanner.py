@@ -2,27 +2,70 @@
 File: arcgis_scanner.py
 Author: Darren Wrigley
 Date: November 22, 2022
-Version: 1.3
+Version: 1.4
 
 Description:
 Process ArcGIS Geospatial Metadata and generate files to be loaded into CDGC
 
 Usage:
-    python arcgis_scanner.py --url <arcgis_url>
+    python arcgis_scanner.py --url <arcgis_url> [--concurrency N]
+    python arcgis_scanner.py --url-file <file with one url per line> [--servers N] [--combined-zip]
+    python arcgis_scanner.py --portal <portal url> [--portal-query <search terms>] [--concurrency N]
 
 Changelog:
 - v1.0: - dwrigley - Initial release
 - v1.1: - bshepherd - Fix issue when URL is not provided by the return metadata
 - v1.2: - bshepherd - Work with folders, formatted output, added some custom attributes
 - v1.3: - bshepherd - Add support for MapServer, added new attributes, Bug Fixes
+- v1.4: - Concurrent crawl mode (--concurrency) with a per-host request limit
+        - Read layer definitions with the service /layers endpoint
+        - Pooled http session with retries, backoff and a per host rate limit
+        - Persistent response cache with conditional revalidation (--cache-dir)
+        - Incremental scans (--delta-state)
+        - Checkpoint and resume long scans (--checkpoint-dir, --resume)
+        - Streaming, constant memory writer (--streaming)
+        - Write the csv files straight into the zip file (--zip-direct, --compression-level)
+        - Scan a list of servers in one process (--url-file, --servers, --combined-zip)
+        - Sharded crawl of one server by several processes, merged into one zip file (--shards)
+        - Read nested folders, concurrently. A folder that cannot be read does not stop the scan
+        - Request, decode and writer metrics report (--metrics)
+        - Record the http exchanges of a scan and replay them offline (--record, --replay)
+        - Decode responses from bytes (orjson when installed), request compact json, prune unused layer blocks
+        - Drop duplicate objects and links when they are written (--dedupe)
+        - Read each layer of a service once, write group layer -> sub layer links (--sublayer-links)
+        - Time and request budgets (--max-duration, --max-requests) and a per service timeout (--service-timeout).
+          --limit counts the services of the whole server once
+        - Typed Parquet / Arrow IPC copy of the output for analytics (--columnar)
+        - Include / exclude services by folder, name and type before reading them, cap the layers per service
+          (--include, --exclude, --max-layers-per-service)
+        - Adaptive per host concurrency (--adaptive-concurrency), AIMD on throttling, timeouts and latency
+        - csv files written with the csv module, pandas is not needed. pyarrow is imported for --columnar only
+        - In-memory rows kept column by column with interned values, less than half the memory on big catalogs
+        - Record count and extent of every layer (--profile-layers), queried in parallel with the crawl
+        - Find the services to scan with the search API of a portal (--portal, --portal-query), pages read ahead of the crawl
 """
 
-import requests
-import json
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from datetime import datetime
+from urllib.parse import urlsplit
 from cdgc_writer import CDGCWriter
+from arcgis_http import JSON_PARSER, ArcGISClient
+from arcgis_cache import ResponseCache
+from layer_profiler import LayerProfiler
+from portal_search import PortalSearch
+from scan_budget import ScanBudget
+from scan_filter import ServiceFilter
+from scan_metrics import ScanMetrics
+from scan_state import Checkpoint, DeltaState
 import argparse
+import columnar_writer
+import csv
 import logging
+import os
+import re
+import shutil
+import time
 
 logging.basicConfig(
     level=logging.INFO,
@@ -31,41 +74,102 @@ logging.basicConfig(
 
 
 class ArgGISCrawler:
-    max_layers = 0
-    max_fields = 0
-    total_layers = 0
-    total_fields = 0
-    total_services = 0
-    max_services_to_scan = 0
 
-    hawk = CDGCWriter("./out")
-    arcGisURL = ""
+    version = "1.4"
 
-    version = "1.3"
+    # parts of a layer document that are never written (symbology, feature templates, index definitions)
+    PRUNED_LAYER_KEYS = ["drawingInfo", "types", "templates", "indexes"]
 
-    def __init__(self, limit: int):
+    # crawler state saved with each checkpoint
+    CHECKPOINT_COUNTERS = ["max_layers", "max_fields", "total_layers", "total_fields", "total_services", "svcs_to_scan"]
+
+    # share of --max-requests / --max-duration the service documents read to rank the services may use
+    RANKING_SHARE = 0.25
+
+    def __init__(
+        self,
+        limit: int,
+        concurrency: int = 1,
+        bulk_layers: bool = True,
+        client: ArcGISClient = None,
+        delta: DeltaState = None,
+        checkpoint: Checkpoint = None,
+        resume: bool = False,
+        writer: CDGCWriter = None,
+        service_timeout: float = 0,
+        service_filter: ServiceFilter = None,
+        max_layers_per_service: int = 0,
+        profiler: LayerProfiler = None,
+    ):
         logging.info(f"Initializing ArcGIS scanner arcgis v{self.version}")
 
-        self.max_services_to_scan = limit
+        # counters belong to the instance, several servers can be crawled at the same time
+        self.max_layers = 0
+        self.max_fields = 0
+        self.total_layers = 0
+        self.total_fields = 0
+        self.total_services = 0
+        self.svcs_to_scan = 0
+        self.server_name = ""
+        # services a scan stopped by its budget did not get to read
+        self.not_scanned = 0
 
-    def read_server(self, url: str):
-        logging.info(f"read arcgis server url={url}")
+        self.max_services_to_scan = limit
+        self.bulk_layers = bulk_layers
+        # incremental scan: only new, changed and deleted services are written
+        self.delta = delta
+        self.checkpoint = checkpoint
+        self.resume = resume
+        self.hawk = writer if writer is not None else CDGCWriter("./out")
 
-        arcGisURL = url
+        # concurrency=1 keeps the original strictly sequential crawl, with no worker threads
+        self.concurrency = max(1, concurrency)
+        if client is None:
+            client = ArcGISClient(max_per_host=self.concurrency, pool_size=self.concurrency)
+        self.client = client
+        self.metrics = client.metrics
+        self.budget = client.budget
+        # seconds to read a service and its layers, a service taking longer is skipped (0 = no timeout)
+        self.service_timeout = service_timeout
+        # services and folders left out before any request, layers of a service past the cap are not read (0 = no cap)
+        self.service_filter = service_filter if service_filter else None
+        self.max_layers_per_service = max_layers_per_service
+        # record count and extent queries (--profile-layers). A layer waiting for its count is queued with every row
+        # written after it, (writer method, arguments, layer url of a layer row), and the rows leave the queue in order
+        self.profiler = profiler
+        self.deferred_layers = deque()
+        # service documents read ahead by prioritize(), by service url
+        self.prefetched = {}
+        self.service_pool = None
+        self.layer_pool = None
 
-        parms = {"f": "pjson"}
-        r = requests.get(url, params=parms)
-        if r.status_code != 200:
-            logging.error(f"error: {r}")
+    def ordered_map(self, pool: ThreadPoolExecutor, func, items):
+        """
+        Apply func to each item, yielding results in the order of items no matter which request finishes first.
+        Only a window of tasks is kept in flight so fetched results do not pile up ahead of the writer.
+        """
+        if pool is None:
+            for item in items:
+                yield func(item)
             return
 
-        # assume success
-        server_resp = r.text
-        try:
-            server_obj = json.loads(server_resp)
-        except json.decoder.JSONDecodeError:
-            logging.error("error processing json result returned from url, exiting")
-            return
+        window = deque()
+        for item in items:
+            window.append(pool.submit(func, item))
+            if len(window) >= self.concurrency * 2:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+    def read_server(self, url: str) -> bool:
+        """scan the server at url, returns True when the scan finished and its zip file was written"""
+        logging.info(f"read arcgis server url={url}")
+
+        parms = {"f": "json"}
+        server_obj = self.client.get_json(url, params=parms, kind="server")
+        if server_obj is None:
+            self.hawk.discard()
+            return False
 
         logging.info(f"server version: {server_obj.get('currentVersion')}")
         logging.info(f"services: {len(server_obj.get('services'))}")
@@ -74,121 +178,704 @@ class ArgGISCrawler:
             self.server_name = url.split("/")[3]
         except:
             logging.error("Cannot extract server name from 3rd part if url seperated by /, exiting")
-            return
+            self.hawk.discard()
+            return False
 
-        self.hawk.write_server(self.server_name, url)
+        self.start_pools()
+        try:
+            return self.crawl_server(server_obj, url)
+        finally:
+            self.stop_pools()
 
-        self.svcs_to_scan = len(server_obj.get("services"))
+    def start_pools(self):
+        if self.concurrency > 1:
+            if self.client.adaptive:
+                logging.info(f"Concurrent crawl: {self.concurrency} workers, adaptive limit of up to {self.client.max_per_host} requests per host")
+            else:
+                logging.info(f"Concurrent crawl: {self.concurrency} workers, max {self.client.max_per_host} requests per host")
+            self.service_pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix=f"{self.server_name}-service")
+            self.layer_pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix=f"{self.server_name}-layer")
 
-        logging.info(f"Processing Services at Root level")
+    def stop_pools(self):
+        if self.service_pool is not None:
+            self.service_pool.shutdown()
+            self.layer_pool.shutdown()
+            self.service_pool = None
+            self.layer_pool = None
+        if self.profiler is not None:
+            self.profiler.stop()
 
-        for service_obj in server_obj["services"]:
-            self.total_services += 1
-            self.read_service(service_obj, url, "")
-            if self.total_services >= self.max_services_to_scan:
-                logging.error(f"max services to scan level hit: {self.max_services_to_scan} ending")
-                break
+    def list_server(self, url: str):
+        """read the server and folder listings, returns the crawl frontier or None if the server cannot be listed"""
 
-        if "folders" in server_obj:
-            logging.info(f"Processing any Folders")
-            for folder in server_obj["folders"]:
-
-                logging.info(f"Processing Folder : {folder}")
-                folderURL = url + "/" + folder
-                logging.debug(f"Folder URL: {folderURL}")
-                logging.debug(f"read arcgis server url={folderURL}")
-
-                parms = {"f": "pjson"}
-                r = requests.get(folderURL, params=parms)
-                if r.status_code != 200:
-                    logging.error(f"error: {r}")
-                    return
-
-                # assume success
-                server_resp = r.text
-                try:
-                    server_obj = json.loads(server_resp)
-                except json.decoder.JSONDecodeError:
-                    logging.error("error processing json result returned from url, exiting")
-                    return
-
-                self.hawk.write_folder(self.server_name, folder)
-
-                if "services" in server_obj:
-                    for service_obj in server_obj["services"]:
-                        self.total_services += 1
-                        self.read_service(service_obj, url, folder)
-                        if self.total_services >= self.max_services_to_scan:
-                            logging.error(f"max services to scan level hit: {self.max_services_to_scan} ending")
-                            break
+        server_obj = self.client.get_json(url, params={"f": "json"}, kind="server")
+        if server_obj is None:
+            return None
+        self.server_name = url.split("/")[3]
+
+        self.start_pools()
+        try:
+            return self.build_frontier(server_obj, url)
+        finally:
+            self.stop_pools()
+
+    def crawl_shard(self, url: str, entries: list, with_server: bool):
+        """crawl a slice of the frontier of a server into this crawler's writer, used by the worker processes of a sharded scan"""
+
+        self.server_name = url.split("/")[3]
+        if with_server:
+            self.hawk.write_server(self.server_name, url)
 
+        self.start_pools()
+        try:
+            self.crawl_frontier(entries, 0, url)
+        finally:
+            self.stop_pools()
+        self.finalize()
+
+    def finalize(self):
+        tstart = time.perf_counter()
+        self.hawk.finalize_scan()
+        if self.metrics is not None:
+            self.metrics.add("finalize_seconds", time.perf_counter() - tstart)
+            for counter in ["service_count", "layer_count", "field_count", "folder_count"]:
+                self.metrics.add(f"exported_{counter.replace('_count', 's')}", getattr(self.hawk, counter))
+            self.metrics.add("duplicate_objects", self.hawk.duplicate_items)
+            self.metrics.add("duplicate_links", self.hawk.duplicate_links)
+            if self.profiler is not None:
+                self.metrics.add("profiled_layers", self.profiler.counts["profiled"])
+
+    def crawl_server(self, server_obj: dict, url: str) -> bool:
+
+        resumed = self.checkpoint is not None and self.resume and self.restore_checkpoint(url)
+        if resumed:
+            frontier, start = resumed
+        else:
+            if self.checkpoint is not None:
+                # a checkpoint left by an older scan does not match the new journal
+                self.checkpoint.clear()
+                self.hawk.start_journal(self.checkpoint.journal_path)
+            self.hawk.write_server(self.server_name, url)
+            frontier = self.build_frontier(server_obj, url)
+            if self.budget is not None:
+                frontier = self.prioritize(frontier, url)
+            start = 0
+
+        stopped = self.crawl_frontier(frontier, start, url)
+        if stopped is not None:
+            self.not_scanned = sum(1 for entry in frontier[stopped:] if entry["kind"] == "service" and self.is_scannable(entry["ref"]))
+            logging.warning(
+                f"Scan budget reached ({self.budget.reason}) after {self.budget.elapsed():.0f}s and {self.budget.requests} requests: "
+                f"{self.not_scanned} services not scanned, writing the services read so far"
+            )
+            if self.metrics is not None:
+                self.metrics.add("services_not_scanned", self.not_scanned)
+            if self.checkpoint is not None:
+                # the next scan window continues from here with --resume
+                self.save_checkpoint(url, frontier, stopped)
+
+        if self.delta is not None:
+            self.write_deleted_services()
+
+        self.log_totals()
+        logging.info(f"Concurrency: {self.client.host_limit(url)}")
+
+        self.finalize()
+
+        if stopped is not None and self.checkpoint is not None:
+            # the delta state is saved by the scan that finishes, the resumed one reads the same previous state
+            logging.info(f"Checkpoint kept in {self.checkpoint.folder}, run the scan again with --resume to continue")
+            return True
+        if self.delta is not None:
+            self.delta.save()
+        if self.checkpoint is not None:
+            self.checkpoint.clear()
+        return True
+
+    def log_totals(self):
         logging.info(f"Max Layers: {self.max_layers}")
         logging.info(f"Max Fields: {self.max_fields}")
         logging.info(f"Total services: {self.svcs_to_scan} exported={self.hawk.service_count}")
         logging.info(f"Total Layers: {self.total_layers} exported={self.hawk.layer_count}")
         logging.info(f"Total Fields: {self.total_fields} exported={self.hawk.field_count}")
         logging.info(f"Total Folders: {self.hawk.folder_count} exported={self.hawk.folder_count}")
+        logging.info(f"JSON decode: {self.client.decode_seconds:.2f}s ({JSON_PARSER})")
+        if self.profiler is not None:
+            logging.info(f"Layer profiles: {self.profiler.describe()}")
 
-        self.hawk.finalize_scan()
+    def read_portal(self, portal_url: str, search: PortalSearch) -> bool:
+        """scan the services found by a search of the portal at portal_url, returns True when the zip file was written"""
+        logging.info(f"read arcgis portal url={portal_url}")
 
-    def read_service(self, service_ref: dict, url: str, folder: str):
+        self.start_pools()
+        try:
+            stopped = self.crawl_frontier(self.portal_frontier(search), 0, portal_url)
+        finally:
+            self.stop_pools()
+        if stopped is not None:
+            logging.warning(
+                f"Scan budget reached ({self.budget.reason}) after {self.budget.elapsed():.0f}s and {self.budget.requests} requests: "
+                f"the rest of the portal search is not scanned, writing the services read so far"
+            )
 
-        # We only process FeatureServer and MapServer types, which typically have data fields customers extract data from
-        if service_ref["type"] != "FeatureServer" and service_ref["type"] != "MapServer" :
+        logging.info(f"Portal search: {search.describe()}")
+        self.log_totals()
+        self.finalize()
+        return True
+
+    def portal_frontier(self, search: PortalSearch):
+        """
+        frontier entries of the services found by a portal search, produced while the crawl goes on. The services of
+        several servers can be found, each entry has the url of its server, and a server and a folder entry come
+        before the first service of each server and folder
+        """
+
+        if self.service_filter is not None:
+            logging.info(f"Service filter: {self.service_filter.describe()}")
+
+        server_names = {}
+        folders = set()
+        for server_url, folder, service_ref in search.services():
+            self.total_services += 1
+            if self.service_filter is not None and not self.service_filter.keep(folder, service_ref):
+                continue
+            if self.svcs_to_scan >= self.max_services_to_scan:
+                logging.error(f"max services to scan level hit: {self.max_services_to_scan}, the rest of the portal search is not scanned")
+                return
+            self.svcs_to_scan += 1
+
+            if server_url not in server_names:
+                name = self.portal_server_name(server_url)
+                if name in server_names.values():
+                    logging.warning(f"servers with the same server name {name} are scanned, their externalIds will collide")
+                server_names[server_url] = name
+                logging.info(f"Server found by the portal search: {server_url}")
+                yield {"kind": "server", "folder": "", "ref": None, "server": server_url}
+
+            # parent folders first, like the listing of a server
+            parts = folder.split("/") if folder else []
+            for depth in range(1, len(parts) + 1):
+                path = "/".join(parts[:depth])
+                if (server_url, path) not in folders:
+                    folders.add((server_url, path))
+                    yield {"kind": "folder", "folder": path, "ref": None, "server": server_url}
+
+            yield {"kind": "service", "folder": folder, "ref": service_ref, "server": server_url}
+
+    def portal_server_name(self, server_url: str) -> str:
+        # the same server name as a scan of the server with --url, so both give the same externalIds
+        return server_url.split("/")[3]
+
+    def build_frontier(self, server_obj: dict, url: str) -> list:
+        """
+        list everything the scan will write, in output order: the root services, then each folder followed by its services
+        and its nested folders. returns a list of {"kind": "folder"|"service", "folder": ..., "ref": service_ref}
+        """
+
+        if self.service_filter is not None:
+            logging.info(f"Service filter: {self.service_filter.describe()}")
+
+        frontier = []
+        self.list_services(server_obj["services"])
+        for service_ref in self.filter_services("", server_obj["services"]):
+            frontier.append({"kind": "service", "folder": "", "ref": service_ref})
+
+        if "folders" in server_obj:
+            logging.info(f"Processing any Folders")
+
+            listings = self.read_folders(url, server_obj["folders"])
+
+            # depth first in listing order, whatever order the folder requests finished in
+            placed = set()
+            stack = list(reversed(server_obj["folders"]))
+            while stack:
+                folder = stack.pop()
+                if folder in placed or folder not in listings:
+                    # already placed, or left out by the service filter
+                    continue
+                placed.add(folder)
+
+                folder_obj = listings[folder]
+                logging.info(f"Reading Folder : {folder}")
+                if folder_obj is None:
+                    continue
+
+                frontier.append({"kind": "folder", "folder": folder, "ref": None})
+
+                if "services" in folder_obj:
+                    self.list_services(folder_obj["services"])
+                    for service_ref in self.filter_services(folder, folder_obj["services"]):
+                        frontier.append({"kind": "service", "folder": folder, "ref": service_ref})
+
+                stack.extend(reversed(self.subfolders(folder, folder_obj)))
+
+            failed = [folder for folder, folder_obj in listings.items() if folder_obj is None]
+            if failed:
+                logging.error(f"{len(failed)} of {len(listings)} folders could not be read: {', '.join(failed)}")
+
+        return self.services_within_limit(frontier)
+
+    def filter_services(self, folder: str, services: list) -> list:
+        if self.service_filter is None:
+            return services
+        kept = [service_ref for service_ref in services if self.service_filter.keep(folder, service_ref)]
+        if len(kept) < len(services):
+            logging.info(f"Service filter: {len(services) - len(kept)} of {len(services)} services left out in {folder or 'the root folder'}")
+        return kept
+
+    def list_folder(self, folder: str) -> bool:
+        if self.service_filter is None or self.service_filter.list_folder(folder):
+            return True
+        logging.info(f"Service filter: folder {folder} not read")
+        # its services are still on the server, they are not reported as deleted
+        if self.delta is not None:
+            self.delta.list_prefix(self.server_name + "/" + folder + "/")
+        return False
+
+    def read_folders(self, url: str, folders: list) -> dict:
+        """
+        read the listing of every folder and of the folders nested in them, service_pool workers at a time.
+        returns {folder: listing}, with None for folders that could not be read
+        """
+
+        def read_folder(folder: str):
+            folderURL = url + "/" + folder
+            logging.debug(f"Folder URL: {folderURL}")
+            logging.debug(f"read arcgis server url={folderURL}")
+
+            parms = {"f": "json"}
+            return self.client.get_json(folderURL, params=parms, kind="folder")
+
+        listings = {}
+        queued = set(folders)
+        pending = deque(folder for folder in folders if self.list_folder(folder))
+        running = {}
+        while pending or running:
+            if self.service_pool is None:
+                folder = pending.popleft()
+                finished = [(folder, read_folder(folder))]
+            else:
+                while pending and len(running) < self.concurrency * 2:
+                    folder = pending.popleft()
+                    running[self.service_pool.submit(read_folder, folder)] = folder
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                finished = [(running.pop(future), future.result()) for future in done]
+
+            for folder, folder_obj in finished:
+                if folder_obj is None:
+                    # one folder failing does not stop the others, its services are just not scanned
+                    listings[folder] = None
+                    if self.delta is not None:
+                        self.delta.list_prefix(self.server_name + "/" + folder + "/")
+                    continue
+                listings[folder] = folder_obj
+                for sub in self.subfolders(folder, folder_obj):
+                    if sub not in queued:
+                        queued.add(sub)
+                        if self.list_folder(sub):
+                            pending.append(sub)
+
+        return listings
+
+    def subfolders(self, folder: str, folder_obj: dict) -> list:
+        # nested folders are listed with their full path, but accept names relative to the parent folder
+        return [sub if sub.startswith(folder + "/") else folder + "/" + sub for sub in folder_obj.get("folders") or []]
+
+    def crawl_frontier(self, frontier, start: int, url: str):
+        """
+        services (and their layers) are fetched in parallel, but always written in frontier order. The frontier is a list,
+        or with start 0 any iterable, e.g. the entries of a portal search produced while the crawl goes on. Entries with a
+        "server" url (portal search) belong to that server instead of url.
+        returns the index of the first service not read because the budget is spent, None when the whole frontier was crawled
+        """
+
+        if start == 0:
+            logging.info(f"Processing Services at Root level")
+
+        def fetch(entry: dict):
+            # the entry comes with its result, the frontier may be an iterable that can only be read once
+            if entry["kind"] != "service":
+                return entry, None
+            if self.budget is not None and self.budget.exhausted():
+                return entry, None
+            tstart = time.perf_counter()
+            fetched = self.fetch_service(entry["ref"], entry.get("server", url))
+            if self.metrics is not None and fetched is not None:
+                self.metrics.service(fetched[0], time.perf_counter() - tstart)
+            return entry, fetched
+
+        entries = frontier[start:] if start else frontier
+        # services of this crawl, the server and folder entries of the frontier do not count for --checkpoint-every
+        services = 0
+        for index, (entry, fetched) in enumerate(self.ordered_map(self.service_pool, fetch, entries), start + 1):
+            if fetched is None and self.budget is not None and entry["kind"] == "service" and self.is_scannable(entry["ref"]):
+                if self.budget.exhausted():
+                    # nothing after this service is written, a resumed scan continues exactly here
+                    self.write_profiled_layers(wait=True)
+                    return index - 1
+
+            tstart = time.perf_counter()
+            server_url = entry.get("server", url)
+            if "server" in entry:
+                # only the writer uses the server name in a portal scan, which cannot be combined with --delta-state
+                self.server_name = self.portal_server_name(server_url)
+            if entry["kind"] == "server":
+                self.write(self.hawk.write_server, self.server_name, server_url)
+            elif entry["kind"] == "folder":
+                logging.info(f"Processing Folder : {entry['folder']}")
+                self.write(self.hawk.write_folder, self.server_name, entry["folder"])
+            elif fetched is not None:
+                self.emit_service(entry["ref"], fetched, server_url, entry["folder"])
+            if self.deferred_layers:
+                self.write_profiled_layers()
+            if self.metrics is not None:
+                self.metrics.add("writer_seconds", time.perf_counter() - tstart)
+
+            if entry["kind"] == "service":
+                services += 1
+                if self.checkpoint is not None and services % self.checkpoint.every == 0:
+                    # the journal of the checkpoint has every layer of the services before index
+                    self.write_profiled_layers(wait=True)
+                    self.save_checkpoint(url, frontier, index)
+        self.write_profiled_layers(wait=True)
+        return None
+
+    def write(self, method, *args):
+        """call a writer method, or queue the row behind the layers still waiting for their count query"""
+        if self.deferred_layers:
+            self.deferred_layers.append((method, args, None))
+        else:
+            method(*args)
+
+    def write_profiled_layers(self, wait: bool = False):
+        """
+        write the queued rows up to the first layer whose count query is still running, all of them with wait.
+        The rows keep the order of the crawl, whichever query is answered first
+        """
+        if self.deferred_layers and wait:
+            waiting = sum(1 for method, args, layer_url in self.deferred_layers if layer_url is not None)
+            logging.info(f"Waiting for the count queries of {waiting} layers")
+        while self.deferred_layers:
+            method, args, layer_url = self.deferred_layers[0]
+            if layer_url is not None:
+                if not wait and not self.profiler.ready(layer_url):
+                    break
+                args = args + (self.profiler.result(layer_url),)
+            method(*args)
+            self.deferred_layers.popleft()
+
+    def save_checkpoint(self, url: str, frontier: list, next_index: int):
+
+        state = {
+            "url": url,
+            "frontier": frontier,
+            "next_index": next_index,
+            "crawler": {name: getattr(self, name) for name in self.CHECKPOINT_COUNTERS},
+            "writer": self.hawk.checkpoint_state(),
+            "delta": self.delta.checkpoint_state() if self.delta is not None else None,
+        }
+        self.checkpoint.save(state)
+        logging.info(f"Checkpoint saved: {next_index}/{len(frontier)} done")
+
+    def restore_checkpoint(self, url: str):
+        """restore the scan state from the last checkpoint, returns (frontier, next_index) or None"""
+
+        state = self.checkpoint.load()
+        if state is None:
+            logging.info(f"No checkpoint found in {self.checkpoint.folder}, starting a full scan")
+            return None
+        if state["url"] != url:
+            logging.error(f"Checkpoint in {self.checkpoint.folder} is for {state['url']}, not {url}, starting a full scan")
+            return None
+
+        for name, value in state["crawler"].items():
+            setattr(self, name, value)
+        self.hawk.restore_state(self.checkpoint.journal_path, state["writer"])
+        if self.delta is not None and state["delta"] is not None:
+            self.delta.restore_state(state["delta"])
+
+        logging.info(f"Resuming scan at {state['next_index']}/{len(state['frontier'])}")
+        return state["frontier"], state["next_index"]
+
+    def list_services(self, services: list):
+        if self.delta is None:
             return
+        for service_ref in services:
+            if self.is_scannable(service_ref):
+                self.delta.list_service(self.server_name + "/" + service_ref["name"])
+
+    def write_deleted_services(self):
+        for external_id, entry in self.delta.deleted_services():
+            logging.info(f"\t- Service deleted: {external_id}")
+            self.hawk.write_deleted(external_id, f"{self.hawk.PACKAGE}.{entry['type']}")
+            for layer_id in entry["layers"]:
+                self.hawk.write_deleted(layer_id, self.hawk.LAYER_CLASS)
+
+    def services_within_limit(self, frontier: list) -> list:
+        # one limit for the whole server, root and folders alike. It counts every listed service, whether or not we can scan its type
+        self.total_services = sum(1 for entry in frontier if entry["kind"] == "service")
+        self.svcs_to_scan = min(self.total_services, self.max_services_to_scan)
+        if self.total_services <= self.max_services_to_scan:
+            return frontier
+
+        logging.error(f"max services to scan level hit: {self.max_services_to_scan} of {self.total_services} listed services are scanned")
+        selected = []
+        services = 0
+        for entry in frontier:
+            if entry["kind"] == "service":
+                services += 1
+                if services > self.max_services_to_scan:
+                    continue
+            selected.append(entry)
+        return selected
+
+    def prioritize(self, frontier: list, url: str) -> list:
+        """
+        order the frontier of a scan with a budget: service documents are read first, breadth first, within
+        RANKING_SHARE of --max-requests / --max-duration, then the services read are crawled most recently edited
+        first, so a scan cut short has the freshest services, and the others follow in listing order. Folders cost
+        no request and are written first, services without an edit date keep their listing order after the others
+        """
+
+        services = [entry for entry in frontier if entry["kind"] == "service" and self.is_scannable(entry["ref"])]
+        # the rest of the budget is left to the crawl, a budget smaller than the listing still writes services
+        max_requests = int(self.budget.max_requests * self.RANKING_SHARE) if self.budget.max_requests > 0 else None
+        ranking_deadline = time.monotonic() + self.budget.max_duration * self.RANKING_SHARE if self.budget.max_duration > 0 else None
+        first_request = self.budget.requests
+        logging.info(f"Reading {len(services)} service documents within {self.RANKING_SHARE:.0%} of the scan budget, most recently edited services are crawled first")
+
+        def fetch(entry: dict):
+            service_url = self.service_url(entry["ref"], url)
+            if max_requests is not None and self.budget.requests - first_request >= max_requests:
+                return service_url, None
+            if ranking_deadline is not None and time.monotonic() >= ranking_deadline:
+                return service_url, None
+            deadline = time.monotonic() + self.service_timeout if self.service_timeout > 0 else None
+            if ranking_deadline is not None:
+                deadline = ranking_deadline if deadline is None else min(deadline, ranking_deadline)
+            return service_url, self.client.get_json(service_url, params={"f": "json"}, kind="service", deadline=deadline)
+
+        ranked = []
+        unread = []
+        for entry, (service_url, service_obj) in zip(services, self.ordered_map(self.service_pool, fetch, services)):
+            if service_obj is None:
+                # not read (ranking share spent, failed, timed out), crawled after the ranked services
+                unread.append(entry)
+                continue
+            self.prefetched[service_url] = service_obj
+            ranked.append((self.last_edit_date(service_obj), entry))
+        if unread:
+            logging.info(f"{len(ranked)} services ranked by edit date, the {len(unread)} others are crawled after them in listing order")
+
+        ranked.sort(key=lambda item: -item[0])
+        return (
+            [entry for entry in frontier if entry["kind"] == "folder"]
+            + [entry for _, entry in ranked]
+            + unread
+            + [entry for entry in frontier if entry["kind"] == "service" and not self.is_scannable(entry["ref"])]
+        )
+
+    def last_edit_date(self, service_obj: dict) -> int:
+        # epoch milliseconds published in the editingInfo of hosted feature services, 0 when there is none
+        editing_info = service_obj.get("editingInfo")
+        if not isinstance(editing_info, dict):
+            return 0
+        dates = [editing_info.get(key) for key in ("lastEditDate", "dataLastEditDate", "schemaLastEditDate")]
+        return max([date for date in dates if isinstance(date, (int, float))], default=0)
+
+    def is_scannable(self, service_ref: dict) -> bool:
+        # We only process FeatureServer and MapServer types, which typically have data fields customers extract data from
+        return service_ref["type"] == "FeatureServer" or service_ref["type"] == "MapServer"
+
+    def read_service(self, service_ref: dict, url: str, folder: str):
+
+        fetched = self.fetch_service(service_ref, url)
+        if fetched is not None:
+            self.emit_service(service_ref, fetched, url, folder)
+
+    def fetch_service(self, service_ref: dict, url: str):
+        """fetch a service document and all of its layers, returns (service_url, service_obj, layers) or None"""
+
+        if not self.is_scannable(service_ref):
+            return None
 
         logging.info(f"\t- Service: {service_ref['name']} ({service_ref['type']})")
         service_name = service_ref["name"]
+        service_url = self.service_url(service_ref, url)
+        deadline = time.monotonic() + self.service_timeout if self.service_timeout > 0 else None
+
+        service_obj = self.prefetched.pop(service_url, None)
+        if service_obj is None:
+            service_obj = self.client.get_json(service_url, params={"f": "json"}, kind="service", deadline=deadline)
+        if service_obj is None:
+            return None
 
+        if self.delta is not None and self.delta.unchanged_before_layers(self.server_name + "/" + service_name, service_obj):
+            logging.info(f"\t- Service unchanged since the previous scan: {service_name}")
+            return service_url, service_obj, None
+
+        # per service layer cache: every layer definition is read once, however many times it is listed
+        layer_refs = []
+        listed = set()
+        for layer_ref in service_obj.get("layers", []):
+            if layer_ref["id"] not in listed:
+                listed.add(layer_ref["id"])
+                layer_refs.append(layer_ref)
+        if self.max_layers_per_service and len(layer_refs) > self.max_layers_per_service:
+            logging.info(f"\t- Service {service_name} has {len(layer_refs)} layers, reading the first {self.max_layers_per_service}")
+            layer_refs = layer_refs[: self.max_layers_per_service]
+
+        layer_docs = {}
+        if self.bulk_layers and layer_refs:
+            layer_docs = self.fetch_layers_bulk(service_url, deadline)
+
+        # anything the bulk response did not include (old servers, truncated responses) is fetched one by one
+        missing = [layer_ref for layer_ref in layer_refs if layer_ref["id"] not in layer_docs]
+        if missing and layer_docs:
+            logging.info(f"\t- bulk layers response is missing {len(missing)} of {len(layer_refs)} layers, fetching them individually")
+
+        fetch = lambda layer_ref: self.fetch_layer(layer_ref, service_url, deadline)
+        while True:
+            for layer_ref, layer_obj in zip(missing, self.ordered_map(self.layer_pool, fetch, missing)):
+                layer_docs[layer_ref["id"]] = layer_obj
+
+            # sub layers of group layers the service document did not list are read too, once
+            missing = []
+            known = {layer_ref["id"] for layer_ref in layer_refs}
+            for layer_ref in list(layer_refs):
+                for sub in self.sublayer_refs(layer_docs.get(layer_ref["id"])):
+                    if self.max_layers_per_service and len(layer_refs) >= self.max_layers_per_service:
+                        break
+                    if sub["id"] not in known:
+                        known.add(sub["id"])
+                        layer_refs.append(sub)
+                        if sub["id"] not in layer_docs:
+                            missing.append(sub)
+            if not missing:
+                break
+
+        layers = [(layer_ref, layer_docs.get(layer_ref["id"])) for layer_ref in layer_refs]
+
+        # a service is written with all of its layers or not at all
+        if deadline is not None and time.monotonic() >= deadline:
+            logging.error(f"\t- Service {service_name} not read within --service-timeout {self.service_timeout:g}s, skipped")
+            return None
+        if self.budget is not None and self.budget.exhausted():
+            return None
+
+        if self.profiler is not None:
+            # the count queries run while the next services are read
+            for layer_ref, layer_obj in layers:
+                self.profiler.submit(service_url + "/" + str(layer_ref["id"]), layer_obj)
+
+        return service_url, service_obj, layers
+
+    def service_url(self, service_ref: dict, url: str) -> str:
         if "url" in service_ref:
-            service_url = url
-        else:
-            service_url = url + "/" + service_name + "/" + service_ref["type"]
+            return url
+        return url + "/" + service_ref["name"] + "/" + service_ref["type"]
 
-        r = requests.get(service_url, params={"f": "pjson"})
-        if r.status_code != 200:
-            logging.error(f"error: {r}")
-            return
+    def sublayer_refs(self, layer_obj) -> list:
+        if not isinstance(layer_obj, dict):
+            return []
+        return [sub for sub in layer_obj.get("subLayers") or [] if isinstance(sub, dict) and "id" in sub]
+
+    def fetch_layers_bulk(self, service_url: str, deadline: float = None) -> dict:
+        """read every layer and table definition of a service with one request, returns {layer id: layer document}"""
+
+        logging.info(f"\t\t- Reading all layers: {service_url}/layers")
+        bulk_obj = self.client.get_json(service_url + "/layers", params={"f": "json"}, log_errors=False, kind="layers", deadline=deadline)
+        if bulk_obj is None or "error" in bulk_obj:
+            logging.debug(f"\t- bulk layers endpoint not available for {service_url}, fetching layers individually")
+            return {}
+
+        layer_docs = {}
+        for layer_obj in (bulk_obj.get("layers") or []) + (bulk_obj.get("tables") or []):
+            if "id" in layer_obj:
+                layer_docs[layer_obj["id"]] = self.prune_layer(layer_obj)
+        return layer_docs
+
+    def prune_layer(self, layer_obj):
+        # drop the big blocks no class attribute is read from, before the document waits in the write window
+        if isinstance(layer_obj, dict):
+            for key in self.PRUNED_LAYER_KEYS:
+                layer_obj.pop(key, None)
+        return layer_obj
+
+    def emit_service(self, service_ref: dict, fetched: tuple, url: str, folder: str):
+
+        service_url, service_obj, layers = fetched
+        service_name = service_ref["name"]
+        parent_id = self.server_name + "/" + service_name
 
-        service_text = r.text
-        service_obj = json.loads(service_text)
+        if self.delta is not None:
+            # layers is None when the service was recognized as unchanged before reading its layers
+            if layers is None:
+                self.delta.keep(parent_id)
+                return
+            layer_ids = [parent_id + "/" + str(layer_ref["id"]) for layer_ref, layer_obj in layers if layer_obj is not None]
+            if not self.delta.record(parent_id, service_ref["type"], service_obj, layers, layer_ids):
+                return
+            for layer_id in self.delta.deleted_layers(parent_id):
+                self.write(self.hawk.write_deleted, layer_id, self.hawk.LAYER_CLASS)
 
-        self.hawk.write_service(self.server_name, service_ref, service_obj, folder, url)
+        self.write(self.hawk.write_service, self.server_name, service_ref, service_obj, folder, url)
 
-        layer_count = len(service_obj["layers"])
+        layer_count = len(layers)
         if layer_count > self.max_layers:
             self.max_layers = layer_count
 
-        logging.debug(f"\t- Service {self.total_services}/{self.svcs_to_scan}: {service_name} layers={len(service_obj['layers'])}")
+        logging.debug(f"\t- Service {self.total_services}/{self.svcs_to_scan}: {service_name} layers={layer_count}")
 
-        for layer in service_obj["layers"]:
-            self.read_layer(layer, service_url, self.server_name + "/" + service_name, service_ref["type"])
+        service_layer_ids = {layer_ref["id"] for layer_ref, layer_obj in layers if layer_obj is not None}
+        for layer_ref, layer_obj in layers:
+            self.emit_layer(layer_ref, layer_obj, service_url, parent_id, service_ref["type"], service_layer_ids)
+
+        # group -> sub layer relations, from the cached definitions
+        for layer_ref, layer_obj in layers:
+            for sub in self.sublayer_refs(layer_obj):
+                if sub["id"] in service_layer_ids:
+                    self.write(self.hawk.write_sublayer, f"{parent_id}/{layer_obj['id']}", f"{parent_id}/{sub['id']}")
 
     def read_layer(self, layer_ref: dict, service_url: str, parent_id: str, serviceType: str):
 
+        layer_obj = self.fetch_layer(layer_ref, service_url)
+        self.emit_layer(layer_ref, layer_obj, service_url, parent_id, serviceType)
+
+    def fetch_layer(self, layer_ref: dict, service_url: str, deadline: float = None):
+
         logging.info(f"\t\t- Reading layer: {layer_ref['id']} -- {layer_ref['name']}")
-        self.total_layers += 1
-        field_count = 0
 
         layer_url = service_url + "/" + str(layer_ref["id"])
 
-        r = requests.get(layer_url, params={"f": "pjson"})
+        return self.prune_layer(self.client.get_json(layer_url, params={"f": "json"}, kind="layer", deadline=deadline))
 
-        if r.status_code != 200:
-            logging.error(f"error: {r}")
+    def emit_layer(self, layer_ref: dict, layer_obj: dict, service_url: str, parent_id: str, serviceType: str, service_layer_ids: set = None):
+
+        self.total_layers += 1
+        field_count = 0
+
+        if layer_obj is None:
             return
 
-        layer_text = r.text
-        layer_obj = json.loads(layer_text)
+        layer_url = service_url + "/" + str(layer_ref["id"])
 
-        self.hawk.write_layer(parent_id, layer_obj, layer_url, serviceType)
+        if self.profiler is None:
+            self.hawk.write_layer(parent_id, layer_obj, layer_url, serviceType)
+        elif not self.deferred_layers and self.profiler.ready(layer_url):
+            self.hawk.write_layer(parent_id, layer_obj, layer_url, serviceType, self.profiler.result(layer_url))
+        else:
+            # a slow count query does not hold up the crawl, the layer is written once it and the layers queued
+            # before it are answered. Its fields and nested layers are queued behind it, as rows of their own
+            layer_doc = {key: value for key, value in layer_obj.items() if key not in ("fields", "layers")}
+            self.deferred_layers.append((self.hawk.write_layer, (parent_id, layer_doc, layer_url, serviceType), layer_url))
 
         if "fields" in layer_obj:
             if layer_obj["fields"] is not None:
                 field_count = len(layer_obj["fields"])
                 self.total_fields += field_count
                 for pos, field in enumerate(layer_obj["fields"]):
-                    self.hawk.write_field(parent_id + "/" + str(layer_obj["id"]), field, pos + 1)
+                    self.write(self.hawk.write_field, parent_id + "/" + str(layer_obj["id"]), field, pos + 1)
         else:
             field_count = 0
             logging.error(f"\t- Layer has no fields???")
@@ -196,12 +883,15 @@ class ArgGISCrawler:
         if "layers" in layer_obj:
             logging.debug(f"\t-Nested layers: {len(layer_obj['layers'])}")
             for sublayer in layer_obj["layers"]:
+                # a nested layer the service lists itself is written from its own definition
+                if service_layer_ids and sublayer.get("id") in service_layer_ids:
+                    continue
                 if "fields" in sublayer:
                     field_count = len(sublayer["fields"])
                     logging.debug(f"\t- Nested layer fields : {field_count}")
                     for pos, field in enumerate(sublayer["fields"]):
-                        self.hawk.write_field(
-                            parent_id + "/" + str(layer_obj["id"]), field, pos + 1
+                        self.write(
+                            self.hawk.write_field, parent_id + "/" + str(layer_obj["id"]), field, pos + 1
                         )
 
 
@@ -214,6 +904,259 @@ class ArgGISCrawler:
     # end of class def
 
 
+def read_url_file(path: str) -> list:
+    """server urls to scan, one per line. Blank lines and lines starting with # are ignored"""
+    urls = []
+    with open(path, encoding="utf8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#") and line not in urls:
+                urls.append(line)
+    return urls
+
+
+def server_key(url: str) -> str:
+    # folder name for the outputs and state of one server, e.g. services1.arcgis.com_zdB7qR0BtYrg0Xpl
+    parts = urlsplit(url)
+    path = parts.path.strip("/").split("/")
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", f"{parts.netloc}_{path[0] if path else ''}")
+
+
+def create_client(args, pool_size: int, processes: int = 1) -> ArcGISClient:
+    """http client for the options of the command line. The per host limits are split between the processes of a sharded scan"""
+
+    cache = None
+    if args.cache_dir:
+        cache = ResponseCache(
+            args.cache_dir,
+            ttl=args.cache_ttl,
+            max_age=args.cache_max_age * 86400,
+            max_size=args.cache_max_mb * 1024 * 1024,
+        )
+
+    max_per_host = args.max_per_host if args.max_per_host > 0 else args.concurrency
+    return ArcGISClient(
+        max_per_host=max(1, -(-max_per_host // processes)),
+        pool_size=pool_size,
+        retries=args.retries,
+        backoff=args.backoff,
+        rate_limit=args.rate_limit / processes,
+        timeout=args.timeout,
+        cache=cache,
+        metrics=ScanMetrics() if args.metrics else None,
+        record=args.record,
+        replay=args.replay,
+        budget=ScanBudget(args.max_duration, args.max_requests) if args.max_duration > 0 or args.max_requests > 0 else None,
+        adaptive=args.adaptive_concurrency,
+    )
+
+
+def create_crawler(args, client: ArcGISClient, output_folder: str, delta_path: str = None, checkpoint_dir: str = None) -> ArgGISCrawler:
+
+    delta = DeltaState(delta_path) if delta_path else None
+    checkpoint = Checkpoint(checkpoint_dir, args.checkpoint_every) if checkpoint_dir else None
+    writer = CDGCWriter(
+        output_folder,
+        streaming=args.streaming,
+        zip_direct=args.zip_direct,
+        compresslevel=args.compression_level,
+        dedupe="auto" if args.dedupe is None else None if args.dedupe == "off" else args.dedupe,
+        bloom_capacity=args.bloom_capacity,
+        columnar=args.columnar,
+        profile_layers=args.profile_layers,
+        sublayer_links=args.sublayer_links,
+    )
+    return ArgGISCrawler(
+        args.limit,
+        args.concurrency,
+        not args.no_bulk_layers,
+        client,
+        delta,
+        checkpoint,
+        args.resume,
+        writer,
+        args.service_timeout,
+        ServiceFilter(args.include, args.exclude),
+        args.max_layers_per_service,
+        LayerProfiler(client, args.profile_concurrency, args.profile_timeout) if args.profile_layers else None,
+    )
+
+
+def scan_servers(urls: list, args, client: ArcGISClient):
+    """
+    scan every server of a --url-file in this process, --servers at a time, sharing the http client.
+    Each server has its own crawler, writer and output folder out/<server key>, optionally followed by
+    one zip file combining all the servers that were scanned successfully.
+    """
+
+    keys = [server_key(url) for url in urls]
+    if len(set(keys)) != len(keys):
+        logging.error("--url-file lists several servers with the same host and server name, their outputs would overwrite each other")
+        return
+
+    def scan(url: str, key: str) -> dict:
+        tstart = time.perf_counter()
+        result = {"url": url, "status": "failed", "services": 0, "layers": 0, "fields": 0, "folders": 0, "seconds": 0.0, "concurrency": "", "zip": ""}
+        try:
+            crawler = create_crawler(
+                args,
+                client,
+                os.path.join("./out", key),
+                os.path.join(args.delta_state, f"{key}.json") if args.delta_state else None,
+                os.path.join(args.checkpoint_dir, key) if args.checkpoint_dir else None,
+            )
+            if crawler.read_server(url):
+                hawk = crawler.hawk
+                result.update(
+                    # partial: stopped by the scan budget, the zip file only has the services read in time
+                    status="partial" if crawler.not_scanned else "ok",
+                    services=hawk.service_count,
+                    layers=hawk.layer_count,
+                    fields=hawk.field_count,
+                    folders=hawk.folder_count,
+                    zip=hawk.zip_path,
+                )
+        except Exception:
+            # one broken server must not stop the others
+            logging.exception(f"scan of {url} failed")
+        result["seconds"] = round(time.perf_counter() - tstart, 1)
+        # servers of the same host share its limit
+        result["concurrency"] = client.host_limit(url)
+        return result
+
+    # the log lines of servers scanned at the same time are interleaved, tag them with the worker thread
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)-5s - %(threadName)s - %(message)s'))
+
+    logging.info(f"Batch scan: {len(urls)} servers, {args.servers} at a time")
+    if args.delta_state:
+        os.makedirs(args.delta_state, exist_ok=True)
+    with ThreadPoolExecutor(args.servers, thread_name_prefix="server") as pool:
+        results = list(pool.map(scan, urls, keys))
+
+    logging.info("Batch scan summary:")
+    for result in results:
+        logging.info(
+            f"\t{result['status']:<7} {result['url']} services={result['services']} layers={result['layers']} "
+            f"fields={result['fields']} folders={result['folders']} seconds={result['seconds']} concurrency {result['concurrency']}"
+        )
+    os.makedirs("./out", exist_ok=True)
+    with open("./out/batch_summary.csv", "w", newline="", encoding="utf8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+
+    failed = [result["url"] for result in results if result["status"] == "failed"]
+    logging.info(f"Batch scan: {len(results) - len(failed)} servers scanned, {len(failed)} failed")
+
+    if args.combined_zip:
+        # server names are the root of every externalId, two servers with the same name would clash in one catalog
+        names = [result["url"].split("/")[3] for result in results if result["status"] != "failed"]
+        if len(set(names)) != len(names):
+            logging.warning("servers with the same server name are combined, their externalIds will collide")
+        CDGCWriter.merge_zips(
+            [result["zip"] for result in results if result["status"] != "failed"],
+            os.path.join("./out", CDGCWriter.ZIPFILE_NAME),
+            args.compression_level,
+        )
+
+
+def scan_shard(args, url: str, entries: list, output_folder: str, with_server: bool) -> dict:
+    """worker process of a sharded scan: crawl a slice of the frontier into its own zip file, returns its counters"""
+
+    client = create_client(args, args.concurrency, args.shards)
+    try:
+        crawler = create_crawler(args, client, output_folder)
+        crawler.crawl_shard(url, entries, with_server)
+    finally:
+        # the cache is evicted once, by the main process
+        client.close(evict=False)
+
+    hawk = crawler.hawk
+    return {
+        "metrics": client.metrics.state() if client.metrics is not None else None,
+        "decode_seconds": client.decode_seconds,
+        "zip": hawk.zip_path,
+        "counters": [hawk.service_count, hawk.layer_count, hawk.field_count, hawk.folder_count],
+        "totals": [crawler.total_layers, crawler.total_fields],
+        "max": [crawler.max_layers, crawler.max_fields],
+        "concurrency": client.host_limit(url),
+    }
+
+
+def scan_sharded(url: str, args, client: ArcGISClient) -> bool:
+    """
+    scan one server with --shards worker processes. The main process lists the server and its folders, the frontier
+    is cut in consecutive chunks (several per process so a slow chunk does not hold the others up) and each chunk is
+    crawled and written by a worker process into out/shards/<chunk>. The chunk zip files are merged in frontier order,
+    so the result is the same as a scan by a single process, with duplicate links removed.
+    """
+
+    # the main process only lists the server, its writer keeps its (empty) links in a temporary file instead of in out/links.csv
+    writer = CDGCWriter("./out", zip_direct=True)
+    crawler = ArgGISCrawler(
+        args.limit, args.concurrency, not args.no_bulk_layers, client, writer=writer, service_filter=ServiceFilter(args.include, args.exclude)
+    )
+    frontier = crawler.list_server(url)
+    writer.discard()
+    if frontier is None:
+        logging.error(f"cannot list server {url}")
+        return False
+
+    services = [index for index, entry in enumerate(frontier) if entry["kind"] == "service"]
+    chunk_count = min(max(1, len(services)), args.shards * 4)
+    chunk_size = -(-len(services) // chunk_count) if services else 1
+    # cut before every chunk_size-th service, a folder entry is written by the chunk it falls in
+    cuts = [0] + [services[i] for i in range(chunk_size, len(services), chunk_size)] + [len(frontier)]
+    chunks = [frontier[start:end] for start, end in zip(cuts, cuts[1:])]
+    logging.info(f"Sharded scan: {len(services)} services in {len(chunks)} chunks, {args.shards} processes")
+
+    shard_folder = os.path.join("./out", "shards")
+    with ProcessPoolExecutor(args.shards) as pool:
+        futures = [
+            pool.submit(scan_shard, args, url, chunk, os.path.join(shard_folder, f"chunk_{index:04d}"), index == 0)
+            for index, chunk in enumerate(chunks)
+        ]
+        try:
+            results = [future.result() for future in futures]
+        except Exception:
+            logging.exception(f"sharded scan of {url} failed, no zip file written")
+            return False
+
+    for result in results:
+        if result["metrics"] is not None:
+            client.metrics.merge(result["metrics"])
+        client.decode_seconds += result["decode_seconds"]
+        crawler.total_layers += result["totals"][0]
+        crawler.total_fields += result["totals"][1]
+        crawler.max_layers = max(crawler.max_layers, result["max"][0])
+        crawler.max_fields = max(crawler.max_fields, result["max"][1])
+    service_count, layer_count, field_count, folder_count = [sum(counts) for counts in zip(*[result["counters"] for result in results])]
+
+    logging.info(f"Max Layers: {crawler.max_layers}")
+    logging.info(f"Max Fields: {crawler.max_fields}")
+    logging.info(f"Total services: {crawler.svcs_to_scan} exported={service_count}")
+    logging.info(f"Total Layers: {crawler.total_layers} exported={layer_count}")
+    logging.info(f"Total Fields: {crawler.total_fields} exported={field_count}")
+    logging.info(f"Total Folders: {folder_count} exported={folder_count}")
+    logging.info(f"JSON decode: {client.decode_seconds:.2f}s in {args.shards} processes ({JSON_PARSER})")
+    if args.adaptive_concurrency:
+        for index, result in enumerate(results):
+            # each process has its own limit, up to its share of --max-per-host
+            logging.info(f"Concurrency chunk {index}: {result['concurrency']}")
+
+    tstart = time.perf_counter()
+    CDGCWriter.merge_zips([result["zip"] for result in results], crawler.hawk.zip_path, args.compression_level, dedupe_links=True)
+    if args.columnar:
+        columnar = columnar_writer.ColumnarWriter("./out", args.columnar, CDGCWriter.layout(args.profile_layers))
+        columnar.merge([os.path.dirname(result["zip"]) for result in results], dedupe_links=True)
+        columnar.close()
+    if client.metrics is not None:
+        client.metrics.add("merge_seconds", time.perf_counter() - tstart)
+    shutil.rmtree(shard_folder, ignore_errors=True)
+    return True
+
+
 def main():
     # command-line
     parser = argparse.ArgumentParser()
@@ -221,6 +1164,38 @@ def main():
         "--url",
         help="ArcGIS url to scan - e.g. https://services1.arcgis.com/zdB7qR0BtYrg0Xpl/ArcGIS/rest/services",
     )
+    parser.add_argument(
+        "--url-file",
+        help="file with one ArcGIS url per line, all of them are scanned by this process",
+    )
+    parser.add_argument(
+        "--portal",
+        help="ArcGIS portal whose Feature and Map Services are found with its search API and scanned, "
+             "e.g. https://myorg.maps.arcgis.com or https://gis.example.com/portal",
+    )
+    parser.add_argument(
+        "--portal-query",
+        default="",
+        help="with --portal, search terms the services must match, e.g. owner:gis_admin or tags:parcels. "
+             "The items of the organization of the portal are searched unless the query has an orgid:",
+    )
+    parser.add_argument(
+        "--portal-prefetch",
+        type=int,
+        default=2,
+        help="with --portal, search result pages read ahead of the crawl, at the same time",
+    )
+    parser.add_argument(
+        "--servers",
+        type=int,
+        default=4,
+        help="with --url-file, number of servers scanned at the same time",
+    )
+    parser.add_argument(
+        "--combined-zip",
+        action="store_true",
+        help="with --url-file, also combine the outputs of all servers into out/" + CDGCWriter.ZIPFILE_NAME,
+    )
     parser.add_argument(
         "-l",
         "--limit",
@@ -228,23 +1203,332 @@ def main():
         default=99999,
         help="limit the number of services to scan",
     )
+    parser.add_argument(
+        "--include",
+        action="append",
+        default=[],
+        metavar="FIELD=PATTERN",
+        help="only scan services matching field=pattern, field is folder, name or type, the pattern a glob or re:<regex> "
+             "(e.g. folder=Planning*, type=FeatureServer). Can be repeated",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="FIELD=PATTERN",
+        help="do not scan services matching field=pattern (e.g. folder=Archive, name=re:_old$). Can be repeated",
+    )
+    parser.add_argument(
+        "--sublayer-links",
+        action="store_true",
+        help="link group layers to their sub layers, an association of the updated arcgis_custom_model.json",
+    )
+    parser.add_argument(
+        "--max-layers-per-service",
+        type=int,
+        default=0,
+        help="read at most this many layers of each service (0 = all)",
+    )
+    parser.add_argument(
+        "--max-duration",
+        type=float,
+        default=0,
+        help="seconds the scan may run, then the services read so far are written (0 = no limit). "
+             "With a budget the most recently edited services are crawled first",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=0,
+        help="max http requests sent by the scan, retries included, then the services read so far are written (0 = no limit)",
+    )
+    parser.add_argument(
+        "--service-timeout",
+        type=float,
+        default=0,
+        help="seconds to read one service and its layers, a service taking longer is skipped (0 = no timeout)",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=1,
+        help="number of services/layers to fetch in parallel (1 = sequential crawl)",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="number of worker processes that crawl and write parts of the server, merged into one zip file at the end",
+    )
+    parser.add_argument(
+        "--max-per-host",
+        type=int,
+        default=0,
+        help="max requests in flight against one host (default: same as --concurrency)",
+    )
+    parser.add_argument(
+        "--adaptive-concurrency",
+        action="store_true",
+        help="adapt the requests in flight against each host to its throttling and latency, up to --max-per-host",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="retries for throttled (429), failed (5xx) or dropped requests",
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        default=0.5,
+        help="base delay in seconds for exponential backoff between retries",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=0,
+        help="max requests per second against one host (0 = no limit)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60,
+        help="seconds to wait for a server response",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="folder for the persistent response cache, enables caching and conditional revalidation",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=0,
+        help="seconds a cached response is used without revalidating it with the server (default 0 = always revalidate)",
+    )
+    parser.add_argument(
+        "--cache-max-age",
+        type=float,
+        default=30,
+        help="days after which unused cache entries are evicted",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=1024,
+        help="max size of the response cache in MB",
+    )
+    parser.add_argument(
+        "--delta-state",
+        help="state file of an incremental scan, only services changed since the scan that wrote it are exported "
+             "(a folder with one state file per server with --url-file)",
+    )
+    parser.add_argument(
+        "--checkpoint-dir",
+        help="folder for periodic checkpoints of the scan, a scan that died can be continued with --resume "
+             "(one sub folder per server with --url-file)",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=25,
+        help="save a checkpoint after every N services",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the scan from the last checkpoint in --checkpoint-dir",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="append rows to the class files while scanning instead of keeping them in memory (flat memory use on big servers)",
+    )
+    parser.add_argument(
+        "--zip-direct",
+        action="store_true",
+        help="write the csv files into the zip file without csv files in the output folder, through one temporary file at a time",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        choices=range(0, 10),
+        default=None,
+        metavar="0-9",
+        help="DEFLATE compression level of the zip file (default 6)",
+    )
+    parser.add_argument(
+        "--record",
+        help="record every http exchange of the scan to this replay archive (.jsonl.gz)",
+    )
+    parser.add_argument(
+        "--replay",
+        help="answer every request from this replay archive, without network access",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="write a report of request latencies, bytes, decode and writer time to this file (Prometheus textfile if it ends with .prom, json otherwise)",
+    )
+    parser.add_argument(
+        "--dedupe",
+        choices=["hash", "bloom", "off"],
+        help="drop objects and links written twice: hash (default) keeps a hash of every key, about 70 bytes each, "
+             "bloom a Bloom filter of fixed size (1 in a million objects may be dropped wrongly, default with --streaming), "
+             "off writes everything",
+    )
+    parser.add_argument(
+        "--bloom-capacity",
+        type=int,
+        default=10000000,
+        help="number of objects + links the Bloom filter of --dedupe bloom is sized for",
+    )
+    parser.add_argument(
+        "--columnar",
+        choices=["parquet", "arrow"],
+        help="also write each class and the links as a typed, zstd compressed Parquet or Arrow IPC file in out/<format> (needs pyarrow)",
+    )
+    parser.add_argument(
+        "--no-bulk-layers",
+        action="store_true",
+        help="fetch each layer with its own request instead of using the service /layers endpoint",
+    )
+    parser.add_argument(
+        "--profile-layers",
+        action="store_true",
+        help="query the record count and extent of every layer, written as its recordCount and dataExtent attributes",
+    )
+    parser.add_argument(
+        "--profile-concurrency",
+        type=int,
+        default=4,
+        help="count queries of --profile-layers sent at a time, within the --max-per-host limit",
+    )
+    parser.add_argument(
+        "--profile-timeout",
+        type=float,
+        default=30,
+        help="seconds to answer the count query of a layer, the layer is then written without a count",
+    )
     args = parser.parse_args()
 
-    if args.url == None:
+    if args.url == None and args.url_file == None and args.portal == None:
         print("url not specified")
         print(parser.print_help())
         return
 
+    if args.portal and (args.url or args.url_file or args.shards > 1 or args.delta_state or args.checkpoint_dir):
+        print("--portal cannot be combined with --url, --url-file, --shards, --delta-state or --checkpoint-dir")
+        print(parser.print_help())
+        return
+
+    if args.portal_prefetch <= 0:
+        print("portal prefetch cannot be 0 or less")
+        print(parser.print_help())
+        return
+
     if args.limit <= 0:
         print("limit cannot be 0 or less")
         print(parser.print_help())
         return
 
+    try:
+        ServiceFilter(args.include, args.exclude)
+    except ValueError as e:
+        print(e)
+        print(parser.print_help())
+        return
+
+    if args.max_layers_per_service < 0:
+        print("max layers per service cannot be less than 0")
+        print(parser.print_help())
+        return
+
+    if args.max_duration < 0 or args.max_requests < 0 or args.service_timeout < 0:
+        print("max duration, max requests and service timeout cannot be less than 0")
+        print(parser.print_help())
+        return
+
+    if args.resume and not args.checkpoint_dir:
+        print("--resume needs the --checkpoint-dir of the scan to continue")
+        print(parser.print_help())
+        return
+
+    if args.streaming and args.zip_direct:
+        print("--streaming and --zip-direct cannot be combined")
+        print(parser.print_help())
+        return
+
+    if args.streaming and args.dedupe == "hash":
+        print("--streaming cannot be combined with --dedupe hash, its memory grows with the scan: use --dedupe bloom or off")
+        print(parser.print_help())
+        return
+
+    if args.concurrency <= 0:
+        print("concurrency cannot be 0 or less")
+        print(parser.print_help())
+        return
+
+    if args.adaptive_concurrency and args.concurrency == 1:
+        print("--adaptive-concurrency needs --concurrency greater than 1")
+        print(parser.print_help())
+        return
+
+    if args.profile_concurrency <= 0 or args.profile_timeout <= 0:
+        print("profile concurrency and profile timeout cannot be 0 or less")
+        print(parser.print_help())
+        return
+
+    if args.shards <= 0:
+        print("shards cannot be 0 or less")
+        print(parser.print_help())
+        return
+
+    if args.shards > 1 and (args.url_file or args.delta_state or args.checkpoint_dir or args.max_duration or args.max_requests):
+        print("--shards cannot be combined with --url-file, --delta-state, --checkpoint-dir, --max-duration or --max-requests")
+        print(parser.print_help())
+        return
+
+    if args.record and (args.replay or args.cache_dir or args.shards > 1):
+        print("--record cannot be combined with --replay, --cache-dir or --shards")
+        print(parser.print_help())
+        return
+
+    if args.columnar and not columnar_writer.load_pyarrow():
+        print("--columnar needs pyarrow, pip install pyarrow")
+        return
+
+    if args.url_file and args.servers <= 0:
+        print("servers cannot be 0 or less")
+        print(parser.print_help())
+        return
+
+    urls = read_url_file(args.url_file) if args.url_file else [args.url]
+    if not urls:
+        print(f"no url in {args.url_file}")
+        return
+
     tstart = datetime.now()
 
-    # initialize the scanner object
-    arcgis = ArgGISCrawler(args.limit)
-    arcgis.read_server(args.url)
+    # one connection pool for every server of the scan
+    servers = min(args.servers, len(urls)) if args.url_file else 1
+    client = create_client(args, args.concurrency * servers)
+
+    if args.url_file:
+        scan_servers(urls, args, client)
+    elif args.portal:
+        crawler = create_crawler(args, client, "./out")
+        crawler.read_portal(args.portal, PortalSearch(client, args.portal, args.portal_query, args.portal_prefetch))
+    elif args.shards > 1:
+        scan_sharded(args.url, args, client)
+    else:
+        # initialize the scanner object
+        arcgis = create_crawler(args, client, "./out", args.delta_state, args.checkpoint_dir)
+        arcgis.read_server(args.url)
+    client.close()
+
+    if client.metrics is not None:
+        client.metrics.log_summary()
+        client.metrics.write(args.metrics)
 
     tend = datetime.now()
     logging.info(f"process completed in {(tend - tstart)} ")
@@ -0,0 +1,164 @@
+"""
+File: benchmark_scanner.py
+Version: 1.4
+
+Description:
+Times arcgis_scanner.py against a local mock ArcGIS server, sequentially and with --concurrency,
+and checks that every run produced exactly the same CDGC zip contents.
+
+Each run is a separate scanner process working in its own temporary directory, the same way the
+scanner is run in production. For each concurrency the scan is repeated --repeat times and the median
+wall time is reported, with services/sec, layers/sec and the peak RSS of the scanner process.
+
+The catalog, the latency jitter and the injected errors only depend on the options (and --seed), so
+two runs of the benchmark on the same host are comparable. --json saves the results to compare a
+change of the scanner against an earlier run.
+
+Usage:
+    python benchmark_scanner.py --services 50 --layers 10 --latency 0.05 --concurrency 1 8 16
+    python benchmark_scanner.py --error-rate 0.05 --scanner-args "--backoff 0.05" --repeat 3 --json results.json
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from mock_arcgis_server import MockArcGISServer, MockCatalog
+
+SCANNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "arcgis_scanner.py")
+SERVICE_FILES = ["esri.arcgis.custom.FeatureServer.csv", "esri.arcgis.custom.MapServer.csv"]
+LAYER_FILE = "esri.arcgis.custom.Layer.csv"
+
+
+def run_scan(url: str, concurrency: int, workdir: str, scanner_args: list):
+    """run one scan, returns (seconds, peak RSS in MB or None where the platform cannot tell)"""
+    command = [sys.executable, SCANNER, "--url", url, "--concurrency", str(concurrency)] + scanner_args
+    tstart = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if hasattr(os, "wait4"):
+        # rusage of this child only, RUSAGE_CHILDREN would report the max of all the runs so far
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        peak_rss = rusage.ru_maxrss / 1024
+    else:
+        proc.wait()
+        peak_rss = None
+    elapsed = time.perf_counter() - tstart
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, command)
+    return elapsed, peak_rss
+
+
+def zip_contents(workdir: str) -> dict:
+    with zipfile.ZipFile(os.path.join(workdir, "out", "arcgis_custom_metadata_cdgc.zip")) as zipf:
+        return {name: zipf.read(name) for name in sorted(zipf.namelist())}
+
+
+def row_count(output: dict, names: list) -> int:
+    rows = 0
+    for name in names:
+        if name in output:
+            rows += sum(1 for _ in csv.reader(io.StringIO(output[name].decode("utf8")))) - 1
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the ArcGIS scanner against a mock server")
+    parser.add_argument("--services", type=int, default=50)
+    parser.add_argument("--folders", type=int, default=2)
+    parser.add_argument("--subfolders", type=int, default=0, help="nested folders in each folder")
+    parser.add_argument("--layers", type=int, default=10, help="layers per service")
+    parser.add_argument("--fields", type=int, default=20, help="fields per layer")
+    parser.add_argument("--symbols", type=int, default=0, help="renderer classes in the drawingInfo of each layer")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds added on top of --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of the requests answered with a 503 or 429")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the jitter and the injected errors")
+    parser.add_argument("--capacity", type=int, default=0, help="requests the mock server works on at a time, 0 = no limit")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 16])
+    parser.add_argument("--repeat", type=int, default=1, help="runs per concurrency, the median time is reported")
+    parser.add_argument("--no-bulk-layers", action="store_true", help="crawl with one request per layer")
+    parser.add_argument("--scanner-args", default="", help='extra scanner options, e.g. "--streaming --backoff 0.05"')
+    parser.add_argument("--json", help="save the results to this file")
+    args = parser.parse_args()
+
+    scanner_args = shlex.split(args.scanner_args)
+    if args.no_bulk_layers:
+        scanner_args.append("--no-bulk-layers")
+
+    catalog = MockCatalog(args.services, args.layers, args.fields, args.folders, subfolders=args.subfolders, symbols=args.symbols)
+    server = MockArcGISServer(catalog, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed, capacity=args.capacity).start()
+
+    print(f"python {platform.python_version()} on {platform.platform()}, {os.cpu_count()} cpus")
+    print(f"mock catalog: services={args.services} folders={args.folders} subfolders={args.subfolders} "
+          f"layers/service={args.layers} fields/layer={args.fields} symbols/layer={args.symbols} latency={args.latency}s jitter={args.jitter}s "
+          f"error-rate={args.error_rate} seed={args.seed} capacity={args.capacity or '-'}")
+    print(f"scanner options: {' '.join(scanner_args) or '-'}")
+    print(f"{'concurrency':>11} {'requests':>9} {'errors':>7} {'seconds':>9} {'services/s':>11} {'layers/s':>9} "
+          f"{'peak MB':>8} {'speedup':>8}  output")
+
+    results = []
+    baseline_time = None
+    baseline_output = None
+    try:
+        for concurrency in args.concurrency:
+            times = []
+            peak_rss = None
+            same = True
+            requests_before = server.request_count
+            errors_before = server.error_count
+            for _ in range(args.repeat):
+                server.reset()
+                with tempfile.TemporaryDirectory() as workdir:
+                    elapsed, rss = run_scan(server.url, concurrency, workdir, scanner_args)
+                    output = zip_contents(workdir)
+                times.append(elapsed)
+                if rss is not None:
+                    peak_rss = max(peak_rss or 0, rss)
+                if baseline_output is None:
+                    baseline_output = output
+                same = same and output == baseline_output
+
+            elapsed = statistics.median(times)
+            if baseline_time is None:
+                baseline_time = elapsed
+            services = row_count(output, SERVICE_FILES)
+            layers = row_count(output, [LAYER_FILE])
+            result = {
+                "concurrency": concurrency,
+                "requests": (server.request_count - requests_before) // args.repeat,
+                "errors": (server.error_count - errors_before) // args.repeat,
+                "seconds": round(elapsed, 3),
+                "services_per_second": round(services / elapsed, 1),
+                "layers_per_second": round(layers / elapsed, 1),
+                "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None,
+                "speedup": round(baseline_time / elapsed, 2),
+                "identical_output": same,
+            }
+            results.append(result)
+            print(f"{concurrency:>11} {result['requests']:>9} {result['errors']:>7} {elapsed:>9.2f} "
+                  f"{result['services_per_second']:>11} {result['layers_per_second']:>9} "
+                  f"{result['peak_rss_mb'] if peak_rss is not None else '-':>8} {result['speedup']:>7}x  "
+                  f"{'identical' if same else 'DIFFERENT'}")
+    finally:
+        server.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump({"options": vars(args), "python": platform.python_version(), "results": results}, f, indent=2)
+        print(f"results saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
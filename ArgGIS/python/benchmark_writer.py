@@ -0,0 +1,146 @@
+"""
+File: benchmark_writer.py
+Version: 1.4
+
+Description:
+Measures the memory and time CDGCWriter takes to write a big synthetic catalog, without a server: the
+service and layer documents of a MockCatalog are serialized and parsed again (the way the crawler gets
+them from the http responses) and written in the order the crawler writes them.
+
+Reports the resident memory before writing, the peak resident memory of the process, and the write and
+finalize times. The peak covers the whole process, run one writer mode per invocation.
+
+--unique-names gives every field of every layer its own name and alias. Real catalogs are in between:
+many layers share field names (OBJECTID, SHAPE, GlobalID...), the mock catalog shares all of them.
+
+Usage:
+    python benchmark_writer.py --services 200 --layers 10 --fields 1000
+    python benchmark_writer.py --services 200 --layers 10 --fields 1000 --mode zip-direct --unique-names
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from arcgis_http import JSON_PARSER, loads
+from cdgc_writer import CDGCWriter
+from mock_arcgis_server import MockCatalog
+
+SERVER_NAME = "mock"
+SERVER_URL = "http://127.0.0.1/mock/rest/services"
+
+
+def rss_mb() -> float:
+    """current resident memory, from /proc where available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return 0.0
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def fetched(doc: dict) -> dict:
+    # a parsed response, its strings are new objects like the ones of a real response
+    return loads(json.dumps(doc).encode("utf8"))
+
+
+def write_catalog(writer: CDGCWriter, catalog: MockCatalog, unique_names: bool) -> int:
+    writer.write_server(SERVER_NAME, SERVER_URL)
+    for folder in catalog.folders + catalog.subfolders:
+        writer.write_folder(SERVER_NAME, folder)
+
+    fields = 0
+    for service_ref in catalog.service_refs():
+        service_obj = fetched(catalog.service(service_ref["name"], service_ref["type"]))
+        writer.write_service(SERVER_NAME, service_ref, service_obj, service_ref["folder"], SERVER_URL)
+        parent_id = f"{SERVER_NAME}/{service_ref['name']}"
+        service_url = f"{SERVER_URL}/{service_ref['name']}/{service_ref['type']}"
+
+        for layer_ref in service_obj["layers"]:
+            layer_obj = fetched(catalog.layer(service_ref["name"], layer_ref["id"]))
+            writer.write_layer(parent_id, layer_obj, f"{service_url}/{layer_ref['id']}", service_ref["type"])
+            for position, field in enumerate(layer_obj.get("fields") or []):
+                if unique_names:
+                    field["name"] = f"{field['name']}_{fields}"
+                    field["alias"] = f"{field['alias']} {fields}"
+                writer.write_field(f"{parent_id}/{layer_obj['id']}", field, position + 1)
+                fields += 1
+    return fields
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the memory of CDGCWriter on a synthetic catalog")
+    parser.add_argument("--services", type=int, default=200)
+    parser.add_argument("--layers", type=int, default=10, help="layers per service")
+    parser.add_argument("--fields", type=int, default=1000, help="fields per layer")
+    parser.add_argument("--folders", type=int, default=2)
+    parser.add_argument("--mode", choices=["memory", "zip-direct", "streaming"], default="memory", help="writer mode")
+    parser.add_argument("--dedupe", choices=["hash", "bloom", "off"], help="default hash, bloom with --mode streaming")
+    parser.add_argument("--unique-names", action="store_true", help="no field name or alias shared by two layers")
+    parser.add_argument("--json", help="save the results to this file")
+    args = parser.parse_args()
+
+    catalog = MockCatalog(args.services, args.layers, args.fields, args.folders)
+    output_folder = tempfile.mkdtemp(prefix="benchmark_writer_")
+    print(f"python {platform.python_version()} on {platform.platform()}, json parser {JSON_PARSER}")
+    print(f"catalog: services={args.services} layers/service={args.layers} fields/layer={args.fields} "
+          f"unique-names={args.unique_names} mode={args.mode} dedupe={args.dedupe or ('bloom' if args.mode == 'streaming' else 'hash')}")
+
+    try:
+        writer = CDGCWriter(
+            output_folder,
+            streaming=args.mode == "streaming",
+            zip_direct=args.mode == "zip-direct",
+            dedupe="auto" if args.dedupe is None else None if args.dedupe == "off" else args.dedupe,
+        )
+        rss_before = rss_mb()
+
+        tstart = time.perf_counter()
+        fields = write_catalog(writer, catalog, args.unique_names)
+        write_seconds = time.perf_counter() - tstart
+        rss_written = rss_mb()
+
+        tstart = time.perf_counter()
+        writer.finalize_scan()
+        finalize_seconds = time.perf_counter() - tstart
+        zip_mb = os.path.getsize(writer.zip_path) / 2 ** 20
+    finally:
+        shutil.rmtree(output_folder, ignore_errors=True)
+
+    result = {
+        "fields": fields,
+        "rss_before_mb": round(rss_before, 1),
+        "rss_written_mb": round(rss_written, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "bytes_per_field": round((rss_written - rss_before) * 2 ** 20 / max(1, fields)),
+        "write_seconds": round(write_seconds, 2),
+        "write_us_per_field": round(write_seconds / max(1, fields) * 1e6, 2),
+        "finalize_seconds": round(finalize_seconds, 2),
+        "zip_mb": round(zip_mb, 1),
+    }
+    print(f"fields written: {fields}")
+    print(f"rss before writing: {result['rss_before_mb']} MB, after writing: {result['rss_written_mb']} MB "
+          f"({result['bytes_per_field']} bytes/field), peak: {result['peak_rss_mb']} MB")
+    print(f"write: {result['write_seconds']}s ({result['write_us_per_field']} us/field), "
+          f"finalize: {result['finalize_seconds']}s, zip file: {result['zip_mb']} MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump({"options": vars(args), "python": platform.python_version(), "result": result}, f, indent=2)
+        print(f"results saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
+import io
 import os
 import csv
+import shutil
+import tempfile
+import json
 import zipfile
 import logging
-import pandas as pd
+
+from columnar_writer import ColumnarWriter
+from id_registry import BloomRegistry, HashRegistry
+from row_buffer import RowBuffer
 
 # import urllib.parse
 logger = logging.getLogger(__name__)
@@ -19,34 +26,168 @@ class CDGCWriter:
     FOLDER_CLASS = f"{PACKAGE}.Folder"
 
     LAYER_FIELD_LINK = f"{PACKAGE}.LayerContainsField"
+    LAYER_SUBLAYER_LINK = f"{PACKAGE}.LayerContainsSubLayer"
     SERVER_FOLDER_LINK = f"{PACKAGE}.ServerToFolder"
     ZIPFILE_NAME = "arcgis_custom_metadata_cdgc.zip"
 
+    # objects removed from the server since the previous incremental scan, not part of the CDGC zip
+    DELETED_FILE_NAME = "deleted_objects.csv"
+
     # because we have many services, these links are incomplete and will be finished when needed
     SERVER_SERVICE_LINK = f"{PACKAGE}.ServerContains"
     FOLDER_SERVICE_LINK = f"{PACKAGE}.FolderTo"
     SERVICE_LAYER_LINK_START = f"{PACKAGE}."
     SERVICE_LAYER_LINK_END = f"ContainsLayer"
 
-    hostname = ""
-    output_folder = "./out"
-
-    folderList = []
-    layerList = []
-    serverList = []
-    fieldList = []
-
-    featureServerList = []
-    mapServerList = []
-
-    service_count = 0
-    layer_count = 0
-    field_count = 0
-    folder_count = 0
-
-    def __init__(self, output_folder: str):
-
+    # columns of each class file, in output order. These are the core attributes plus the model attributes
+    # of the class, and must match the keys of the items built by the write_* methods below
+    CORE_COLUMNS = [
+        "core.externalId",
+        "core.name",
+        "core.description",
+        "core.businessDescription",
+        "core.businessName",
+        "core.reference",
+    ]
+    SERVICE_COLUMNS = CORE_COLUMNS + [
+        f"{PACKAGE}.Copyright",
+        f"{PACKAGE}.HasVersionedData",
+        f"{PACKAGE}.MaxRecordCount",
+        f"{PACKAGE}.hasArchivedData",
+        f"{PACKAGE}.supportedQueryFormats",
+        f"{PACKAGE}.supportsQueryDataElements",
+        f"{PACKAGE}.type",
+        f"{PACKAGE}.units",
+        "core.technicalDescription",
+        f"{PACKAGE}.restServicesLink",
+    ]
+    LAYER_COLUMNS = CORE_COLUMNS + [
+        f"{PACKAGE}.Copyright",
+        f"{PACKAGE}.geometryType",
+        f"{PACKAGE}.hasArchivedData",
+        f"{PACKAGE}.MaxRecordCount",
+        f"{PACKAGE}.supportedQueryFormats",
+        f"{PACKAGE}.supportsAdvancedQueries",
+        f"{PACKAGE}.supportsStatistics",
+        f"{PACKAGE}.Type",
+        "core.technicalDescription",
+    ]
+    # Layer attributes of the layer profiling (--profile-layers), the columns are only written with it so
+    # that a scan without it still loads with a model that does not have them
+    PROFILE_COLUMNS = [
+        f"{PACKAGE}.recordCount",
+        f"{PACKAGE}.dataExtent",
+    ]
+    FIELD_COLUMNS = CORE_COLUMNS + [
+        f"{PACKAGE}.Type",
+        f"{PACKAGE}.alias",
+        f"{PACKAGE}.defaultValue",
+        f"{PACKAGE}.domain",
+        f"{PACKAGE}.editable",
+        f"{PACKAGE}.modelName",
+        f"{PACKAGE}.nullable",
+        "core.Position",
+    ]
+    CLASS_COLUMNS = {
+        SERVER_CLASS: CORE_COLUMNS,
+        FEATURESERVER_CLASS: SERVICE_COLUMNS,
+        MAPSERVER_CLASS: SERVICE_COLUMNS,
+        LAYER_CLASS: LAYER_COLUMNS,
+        FIELD_CLASS: FIELD_COLUMNS,
+        FOLDER_CLASS: CORE_COLUMNS,
+    }
+
+    @classmethod
+    def layout(cls, profile_layers: bool = False) -> dict:
+        """columns of each class, CLASS_COLUMNS with the PROFILE_COLUMNS of the layers when profile_layers"""
+        if not profile_layers:
+            return cls.CLASS_COLUMNS
+        return {**cls.CLASS_COLUMNS, cls.LAYER_CLASS: cls.LAYER_COLUMNS + cls.PROFILE_COLUMNS}
+
+    # columns with few distinct values, each distinct string is kept once in the in-memory rows
+    INTERNED_COLUMNS = {
+        "core.name",
+        f"{PACKAGE}.Copyright",
+        f"{PACKAGE}.geometryType",
+        f"{PACKAGE}.supportedQueryFormats",
+        f"{PACKAGE}.type",
+        f"{PACKAGE}.units",
+        f"{PACKAGE}.Type",
+        f"{PACKAGE}.alias",
+        f"{PACKAGE}.defaultValue",
+        f"{PACKAGE}.domain",
+        f"{PACKAGE}.editable",
+        f"{PACKAGE}.modelName",
+        f"{PACKAGE}.nullable",
+    }
+
+    # order of the class files in the zip file
+    CLASS_NAMES = [
+        SERVER_CLASS,
+        FEATURESERVER_CLASS,
+        MAPSERVER_CLASS,
+        LAYER_CLASS,
+        FIELD_CLASS,
+        FOLDER_CLASS,
+    ]
+
+    def __init__(
+        self,
+        output_folder: str,
+        streaming: bool = False,
+        zip_direct: bool = False,
+        compresslevel: int = None,
+        dedupe: str = "auto",
+        bloom_capacity: int = 10000000,
+        columnar: str = None,
+        profile_layers: bool = False,
+        sublayer_links: bool = False,
+    ):
+
+        # all rows and counters belong to the instance, several servers can be written at the same time
         self.output_folder = output_folder
+        self.zip_path = os.path.join(output_folder, self.ZIPFILE_NAME)
+
+        self.service_count = 0
+        self.layer_count = 0
+        self.field_count = 0
+        self.folder_count = 0
+        self.deleted_count = 0
+
+        self.fDeleted = None
+        self.journal = None
+
+        # objects and links already written, duplicates are dropped (dedupe "hash", "bloom" or None). The hash registry
+        # grows with the scan, "auto" keeps the memory of a streaming writer constant with a Bloom filter
+        if streaming and dedupe == "hash":
+            raise ValueError("streaming and dedupe hash cannot be combined, the hash of every key grows with the scan")
+        if dedupe == "auto":
+            dedupe = "bloom" if streaming else "hash"
+        if dedupe == "bloom":
+            self.registry = BloomRegistry(bloom_capacity)
+        elif dedupe == "hash":
+            self.registry = HashRegistry()
+        else:
+            self.registry = None
+        self.duplicate_items = 0
+        self.duplicate_links = 0
+
+        # streaming: rows are appended to the class files as they are written instead of being kept in memory
+        self.streaming = streaming
+        # zip_direct: no csv file in the output folder, the links go to a temporary file during the scan and each class
+        # file is written to a temporary file of its own just before it is added to the zip file
+        self.zip_direct = zip_direct
+        self.compresslevel = compresslevel
+        # profile_layers: the Layer rows have a record count and extent (--profile-layers)
+        self.profile_layers = profile_layers
+        self.class_columns = self.layout(profile_layers)
+        # sublayer_links: group layers are linked to their sub layers (--sublayer-links), an association of the
+        # updated model, a scan without it loads with the previous model
+        self.sublayer_links = sublayer_links
+        # columnar: typed parquet or arrow copy of every class and the links, next to the csv files
+        self.columnar = ColumnarWriter(output_folder, columnar, self.class_columns) if columnar else None
+        if streaming and zip_direct:
+            raise ValueError("streaming and zip_direct cannot be combined, a zip file is written one member at a time")
         self.init_files()
 
     def init_files(self):
@@ -56,89 +197,323 @@ class CDGCWriter:
             logger.info(f"Creating Folder {self.output_folder}")
             os.makedirs(self.output_folder)
 
-        self.fLinks = open(
-            f"{self.output_folder}/links.csv",
-            "w",
-            newline="",
-            encoding="utf8",
-        )
+        if self.zip_direct:
+            # a temporary file outside of the output folder, added to the zip file and removed by finalize_scan
+            fd, self.links_path = tempfile.mkstemp(prefix="links_", suffix=".csv")
+            self.fLinks = open(fd, "w", newline="", encoding="utf8")
+        else:
+            self.links_path = f"{self.output_folder}/links.csv"
+            self.fLinks = open(
+                self.links_path,
+                "w",
+                newline="",
+                encoding="utf8",
+            )
         self.linkWriter = csv.writer(self.fLinks)
         self.linkWriter.writerow(["Source", "Target", "Association"])
 
+        # rows of each class kept until finalize_scan (not in streaming mode), column by column
+        self.rows = {
+            class_name: RowBuffer(columns, self.INTERNED_COLUMNS) for class_name, columns in self.class_columns.items()
+        }
+
+        # streaming mode: class files are opened with their first row
+        self.class_files = {}
+        self.class_writers = {}
+        self.row_counts = {class_name: 0 for class_name in self.class_columns}
+
+        # a deleted objects file is only written when there are deletions, do not leave one from an earlier scan
+        if os.path.exists(f"{self.output_folder}/{self.DELETED_FILE_NAME}"):
+            os.remove(f"{self.output_folder}/{self.DELETED_FILE_NAME}")
+
+
+    def add_item(self, class_name: str, item: dict) -> bool:
+        """write an object, returns False if an object of the same class and externalId was already written"""
+
+        if not self.register_item(class_name, item):
+            self.duplicate_items += 1
+            logger.debug(f"duplicate {class_name} dropped: {item['core.externalId']}")
+            return False
+
+        self.store_item(class_name, item)
+        if self.journal is not None:
+            self.journal.write(json.dumps([class_name, item]) + "\n")
+        return True
+
+
+    def register_item(self, class_name: str, item: dict) -> bool:
+
+        return self.registry is None or self.registry.add(f"{class_name}\x1f{item['core.externalId']}")
+
+
+    def register_link(self, row: list) -> bool:
 
-    def create_output_file(self, itemArray, filename):
+        return self.registry is None or self.registry.add("\x1f".join(str(value) for value in row))
+
+
+    def store_item(self, class_name: str, item: dict):
+
+        self.row_counts[class_name] += 1
+        if self.columnar is not None:
+            self.columnar.add(class_name, item)
+        if not self.streaming:
+            self.rows[class_name].append(item)
+            return
+
+        writer = self.class_writers.get(class_name)
+        if writer is None:
+            self.class_files[class_name] = open(
+                os.path.join(self.output_folder, f"{class_name}.csv"),
+                "w",
+                newline="",
+                encoding="utf8",
+            )
+            writer = self.class_writer(self.class_files[class_name], class_name)
+            self.class_writers[class_name] = writer
+        writer.writerow(item)
+
+
+    def class_writer(self, f, class_name: str) -> csv.DictWriter:
+
+        # columns in class_columns order, the same layout in every output mode
+        writer = csv.DictWriter(f, fieldnames=self.class_columns[class_name], lineterminator=os.linesep)
+        writer.writeheader()
+        return writer
+
+
+    def add_link(self, row: list):
+
+        if not self.register_link(row):
+            self.duplicate_links += 1
+            return
+
+        self.store_link(row)
+        if self.journal is not None:
+            self.journal.write(json.dumps(["links", row]) + "\n")
+
+
+    def store_link(self, row: list):
+
+        self.linkWriter.writerow(row)
+        if self.columnar is not None:
+            self.columnar.add_link(row)
+
+
+    def start_journal(self, journal_path: str):
+        """record every row written from now on, so a checkpointed scan can be resumed"""
+
+        self.journal = open(journal_path, "w", encoding="utf8")
+
+
+    def checkpoint_state(self) -> dict:
+
+        self.fLinks.flush()
+        for f in self.class_files.values():
+            f.flush()
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+        return {
+            "journal_offset": self.journal.tell(),
+            "service_count": self.service_count,
+            "layer_count": self.layer_count,
+            "field_count": self.field_count,
+            "folder_count": self.folder_count,
+            "deleted_count": self.deleted_count,
+            "duplicate_items": self.duplicate_items,
+            "duplicate_links": self.duplicate_links,
+        }
+
+
+    def restore_state(self, journal_path: str, state: dict):
+        """replay the rows journaled up to a checkpoint, rows written after it are dropped"""
+
+        offset = state["journal_offset"]
+        replayed = 0
+        with open(journal_path, "rb") as journal:
+            for line in journal:
+                if journal.tell() > offset:
+                    break
+                kind, row = json.loads(line)
+                if kind == "links":
+                    self.register_link(row)
+                    self.store_link(row)
+                elif kind == "deleted":
+                    self.write_deleted(*row)
+                else:
+                    self.register_item(kind, row)
+                    self.store_item(kind, row)
+                replayed += 1
+
+        self.service_count = state["service_count"]
+        self.layer_count = state["layer_count"]
+        self.field_count = state["field_count"]
+        self.folder_count = state["folder_count"]
+        self.deleted_count = state["deleted_count"]
+        self.duplicate_items = state.get("duplicate_items", 0)
+        self.duplicate_links = state.get("duplicate_links", 0)
+
+        # continue the journal right after the checkpoint
+        self.journal = open(journal_path, "r+", encoding="utf8")
+        self.journal.truncate(offset)
+        self.journal.seek(offset)
+        logger.info(f"Restored {replayed} rows from checkpoint journal {journal_path}")
+
+
+    def create_output_file(self, rows: RowBuffer, filename):
 
-        df = pd.DataFrame(itemArray)
         os.makedirs(self.output_folder, exist_ok=True)
 
         output_csv = os.path.join(self.output_folder, filename)
-        df.to_csv(output_csv, index=False)
+        with open(output_csv, "w", newline="", encoding="utf8") as f:
+            self.write_rows(f, rows)
 
 
-    def finalize_scan(self):
+    def write_rows(self, f, rows: RowBuffer):
+
+        # same layout as class_writer
+        writer = csv.writer(f, lineterminator=os.linesep)
+        writer.writerow(rows.columns)
+        writer.writerows(rows.rows())
+
+
+    def write_member_rows(self, f, rows: RowBuffer):
+
+        with io.TextIOWrapper(f, encoding="utf8", newline="") as text:
+            self.write_rows(text, rows)
+
+
+    @staticmethod
+    def add_member(zipf: zipfile.ZipFile, name: str, write):
+        """
+        add the member name to zipf, its content written by write(f) into a binary file. The content goes
+        through a temporary file added with zipf.write, which dates the member now and compresses it at the
+        level of zipf (zipf.open(name, "w") dates it 1980-01-01). One member is on disk at a time
+        """
+        fd, path = tempfile.mkstemp(prefix="member_", suffix=".csv")
+        try:
+            with open(fd, "wb") as f:
+                write(f)
+            os.chmod(path, 0o644)
+            zipf.write(path, name)
+        finally:
+            os.remove(path)
+
+
+    def discard(self):
+        """close a writer that is not finalized (it only listed a server), removing its temporary links file"""
 
         self.fLinks.close()
+        if self.zip_direct:
+            os.remove(self.links_path)
 
-        if self.folderList:
-            self.create_output_file(self.folderList, f"{self.FOLDER_CLASS}.csv")
 
-        if self.layerList:
-            self.create_output_file(self.layerList, f"{self.LAYER_CLASS}.csv")
+    def finalize_scan(self):
 
-        if self.serverList:
-            self.create_output_file(self.serverList, f"{self.SERVER_CLASS}.csv")
+        self.fLinks.close()
+
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+        if self.registry is not None:
+            logging.info(f"Duplicates dropped: objects={self.duplicate_items} links={self.duplicate_links}")
 
-        if self.fieldList:
-            self.create_output_file(self.fieldList, f"{self.FIELD_CLASS}.csv")
+        if self.columnar is not None:
+            self.columnar.close()
 
-        if self.featureServerList:
-            self.create_output_file(self.featureServerList, f"{self.FEATURESERVER_CLASS}.csv")
+        if self.fDeleted is not None:
+            self.fDeleted.close()
+            logging.info(f"Deleted objects: {self.deleted_count} written to {self.output_folder}/{self.DELETED_FILE_NAME}")
 
-        if self.mapServerList:
-            self.create_output_file(self.mapServerList, f"{self.MAPSERVER_CLASS}.csv")
+        # only classes with rows in this scan are written, an output folder reused from an earlier
+        # scan may still hold files of classes that are empty now (e.g. incremental scans)
+        class_names = self.CLASS_NAMES
 
+        if self.streaming:
+            for f in self.class_files.values():
+                f.close()
+        elif not self.zip_direct:
+            for class_name in class_names:
+                if self.rows[class_name]:
+                    self.create_output_file(self.rows[class_name], f"{class_name}.csv")
 
         # write to zip file
-        zFileName = f"{self.output_folder}/{self.ZIPFILE_NAME}"
-        logging.info(f"Creating Zipfile: {zFileName}")
+        logging.info(f"Creating Zipfile: {self.zip_path}")
         zipf = zipfile.ZipFile(
-            f"{zFileName}", mode="w", compression=zipfile.ZIP_DEFLATED
-        )
-        zipf.write(
-            f"{self.output_folder}/links.csv",
-            f"links.csv",
-        )
-        zipf.write(
-            f"{self.output_folder}/{self.SERVER_CLASS}.csv",
-            f"{self.SERVER_CLASS}.csv",
+            self.zip_path, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=self.compresslevel
         )
 
-        if self.featureServerList:
-            zipf.write(
-                f"{self.output_folder}/{self.FEATURESERVER_CLASS}.csv",
-                f"{self.FEATURESERVER_CLASS}.csv",
-            )
-        if self.mapServerList:
+        if self.zip_direct:
+            os.chmod(self.links_path, 0o644)
+            zipf.write(self.links_path, "links.csv")
+            os.remove(self.links_path)
+
+            for class_name in class_names:
+                if self.rows[class_name]:
+                    self.add_member(zipf, f"{class_name}.csv", lambda f, rows=self.rows[class_name]: self.write_member_rows(f, rows))
+        else:
             zipf.write(
-                f"{self.output_folder}/{self.MAPSERVER_CLASS}.csv",
-                f"{self.MAPSERVER_CLASS}.csv",
+                self.links_path,
+                f"links.csv",
             )
 
-        zipf.write(
-            f"{self.output_folder}/{self.LAYER_CLASS}.csv",
-            f"{self.LAYER_CLASS}.csv",
-        )
-        zipf.write(
-            f"{self.output_folder}/{self.FIELD_CLASS}.csv",
-            f"{self.FIELD_CLASS}.csv",
-        )
-        zipf.write(
-            f"{self.output_folder}/{self.FOLDER_CLASS}.csv",
-            f"{self.FOLDER_CLASS}.csv",
-        )
+            for class_name in class_names:
+                if self.row_counts[class_name]:
+                    zipf.write(
+                        f"{self.output_folder}/{class_name}.csv",
+                        f"{class_name}.csv",
+                    )
         zipf.close()
 
 
+    @classmethod
+    def merge_zips(cls, zip_paths: list, zip_path: str, compresslevel: int = None, dedupe_links: bool = False) -> int:
+        """
+        combine the CDGC zip files of several scans into one zip file. Each csv file of the result is the
+        concatenation of the same file in every input zip, in the order of zip_paths, with a single header row.
+        dedupe_links keeps only the first occurrence of each link. Returns the number of duplicate links dropped.
+        """
+
+        logging.info(f"Merging {len(zip_paths)} zip files into {zip_path}")
+        sources = [zipfile.ZipFile(path) for path in zip_paths]
+        seen_links = set()
+        dropped = 0
+        try:
+            with zipfile.ZipFile(zip_path, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zipf:
+                for member_name in ["links.csv"] + [f"{class_name}.csv" for class_name in cls.CLASS_NAMES]:
+                    parts = [source for source in sources if member_name in source.namelist()]
+                    if not parts:
+                        continue
+                    def write(member, parts=parts, member_name=member_name):
+                        nonlocal dropped
+                        for index, source in enumerate(parts):
+                            with source.open(member_name) as part:
+                                # the header row never has embedded line breaks
+                                header = part.readline()
+                                if index == 0:
+                                    member.write(header)
+                                if not (dedupe_links and member_name == "links.csv"):
+                                    shutil.copyfileobj(part, member)
+                                    continue
+                                # link rows are ids and a class name, one row per line
+                                for line in part:
+                                    if line in seen_links:
+                                        dropped += 1
+                                        continue
+                                    seen_links.add(line)
+                                    member.write(line)
+
+                    cls.add_member(zipf, member_name, write)
+        finally:
+            for source in sources:
+                source.close()
+
+        if dedupe_links:
+            logging.info(f"Merge: {dropped} duplicate links dropped")
+        return dropped
+
+
     def write_server(self, id: str, url: str):
 
         serverItem = {
@@ -150,13 +525,12 @@ class CDGCWriter:
             "core.reference": "FALSE"
         }
 
-        self.serverList.append(serverItem)
-        self.linkWriter.writerow(["$resource", id, "core.ResourceParentChild"])
+        self.add_item(self.SERVER_CLASS, serverItem)
+        self.add_link(["$resource", id, "core.ResourceParentChild"])
 
 
     def write_folder(self, parent_id: str, folder: dict):
 
-        self.folder_count += 1
         objectID = f"{parent_id}/{folder}"
 
         folderItem = {
@@ -168,13 +542,14 @@ class CDGCWriter:
             "core.reference": "FALSE"
         }
 
-        self.folderList.append(folderItem)
-        self.linkWriter.writerow([parent_id, objectID, self.SERVER_FOLDER_LINK])
+        if not self.add_item(self.FOLDER_CLASS, folderItem):
+            return
+        self.folder_count += 1
+        self.add_link([parent_id, objectID, self.SERVER_FOLDER_LINK])
 
 
     def write_service(self, parent_id: str, service_ref: dict, service_data: dict, folder: str, url: str):
 
-        self.service_count += 1
         service_name = service_ref["name"]
         objectID = f"{parent_id}/{service_name}"
 
@@ -207,10 +582,14 @@ class CDGCWriter:
         }
 
         if service_ref.get("type") == "FeatureServer":
-            self.featureServerList.append(serviceItem)
+            if not self.add_item(self.FEATURESERVER_CLASS, serviceItem):
+                return
 
         if service_ref.get("type") == "MapServer":
-            self.mapServerList.append(serviceItem)
+            if not self.add_item(self.MAPSERVER_CLASS, serviceItem):
+                return
+
+        self.service_count += 1
 
         # Some services are in the root folder, some in subfolder, we need to adjust the link
         if folder:
@@ -220,12 +599,10 @@ class CDGCWriter:
             parentObject = parent_id
             link = f"{self.SERVER_SERVICE_LINK}{service_ref.get('type')}"
 
-        self.linkWriter.writerow([parentObject, objectID, link])
+        self.add_link([parentObject, objectID, link])
 
 
-    def write_layer(self, parent_id: str, layer_data: dict, url: str, serviceType: str):
-
-        self.layer_count += 1
+    def write_layer(self, parent_id: str, layer_data: dict, url: str, serviceType: str, profile: dict = None):
 
         if "id" not in layer_data:
             logger.error(f"no id?? {layer_data}")
@@ -252,16 +629,21 @@ class CDGCWriter:
             f"{self.PACKAGE}.supportsAdvancedQueries": layer_data.get("supportsAdvancedQueries", ""),
             f"{self.PACKAGE}.supportsStatistics": layer_data.get("supportsStatistics", ""),
             f"{self.PACKAGE}.Type": layer_data.get("type", ""),
-            "core.technicalDescription": layer_data.get("description", "")
+            "core.technicalDescription": layer_data.get("description", ""),
         }
+        if self.profile_layers:
+            # record count and extent from the layer profiling, empty for a layer that could not be counted
+            layerItem[f"{self.PACKAGE}.recordCount"] = (profile or {}).get("recordCount", "")
+            layerItem[f"{self.PACKAGE}.dataExtent"] = (profile or {}).get("dataExtent", "")
 
-        self.layerList.append(layerItem)
-        self.linkWriter.writerow([parent_id, objectID, f"{self.SERVICE_LAYER_LINK_START}{serviceType}{self.SERVICE_LAYER_LINK_END}"])
+        if not self.add_item(self.LAYER_CLASS, layerItem):
+            return
+        self.layer_count += 1
+        self.add_link([parent_id, objectID, f"{self.SERVICE_LAYER_LINK_START}{serviceType}{self.SERVICE_LAYER_LINK_END}"])
 
 
     def write_field(self, parent_id: str, field_data: dict, position: int):
 
-        self.field_count += 1
         objectID = f"{parent_id}/{field_data['name']}"
 
         fieldItem = {
@@ -281,5 +663,33 @@ class CDGCWriter:
             "core.Position": position
         }
 
-        self.fieldList.append(fieldItem)
-        self.linkWriter.writerow([parent_id, objectID, self.LAYER_FIELD_LINK])
+        if not self.add_item(self.FIELD_CLASS, fieldItem):
+            return
+        self.field_count += 1
+        self.add_link([parent_id, objectID, self.LAYER_FIELD_LINK])
+
+
+    def write_sublayer(self, group_id: str, sublayer_id: str):
+
+        if not self.sublayer_links:
+            return
+
+        self.add_link([group_id, sublayer_id, self.LAYER_SUBLAYER_LINK])
+
+
+    def write_deleted(self, id: str, class_name: str):
+
+        if self.fDeleted is None:
+            self.fDeleted = open(
+                f"{self.output_folder}/{self.DELETED_FILE_NAME}",
+                "w",
+                newline="",
+                encoding="utf8",
+            )
+            self.deletedWriter = csv.writer(self.fDeleted)
+            self.deletedWriter.writerow(["core.externalId", "Class"])
+
+        self.deleted_count += 1
+        self.deletedWriter.writerow([id, class_name])
+        if self.journal is not None:
+            self.journal.write(json.dumps(["deleted", [id, class_name]]) + "\n")
@@ -0,0 +1,230 @@
+"""
+File: columnar_writer.py
+Version: 1.4
+
+Description:
+Typed columnar copy of the scan output for analytics (--columnar parquet|arrow), written next to the csv
+files CDGC loads. Each class and the links get their own file in <output folder>/parquet or
+<output folder>/arrow, zstd compressed.
+
+Column types come from the dataType of the attributes in the custom model (core.Boolean, core.Integer,
+anything else is a string), so nullable/editable stay booleans and MaxRecordCount stays an integer.
+A value that does not fit its type (e.g. "" for a missing attribute) is written as null.
+
+Rows are buffered per class and written as record batches of BATCH_ROWS rows while the scan runs, the
+whole output is never held in memory. Needs pyarrow (optional, pip install pyarrow), imported only when
+a columnar output is written, it adds a tenth of a second to the start of every scan.
+"""
+
+import json
+import logging
+import os
+
+# set by load_pyarrow()
+pa = None
+pq = None
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model", "arcgis_custom_model.json")
+
+# core attributes that are not strings, the model only lists the attributes of the package
+CORE_TYPES = {
+    "core.reference": "core.Boolean",
+    "core.Position": "core.Integer",
+}
+
+LINK_COLUMNS = ["Source", "Target", "Association"]
+LINKS_NAME = "links"
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def load_pyarrow() -> bool:
+    """import pyarrow on first use, returns False if it is not installed"""
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+
+def model_types(model_path: str = MODEL_PATH) -> dict:
+    """dataType of every attribute of the model, by full attribute name e.g. esri.arcgis.custom.nullable"""
+    types = dict(CORE_TYPES)
+    if not os.path.exists(model_path):
+        logging.warning(f"model {model_path} not found, columnar files are written with string columns")
+        return types
+    with open(model_path, encoding="utf8") as f:
+        model = json.load(f)
+    for attribute in model.get("attributes", []):
+        types[f"{model['packageName']}.{attribute['name']}"] = attribute.get("dataType")
+    return types
+
+
+def to_bool(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, str):
+        return {"true": True, "false": False}.get(value.strip().lower())
+    if isinstance(value, (int, float)):
+        return bool(value)
+    return None
+
+
+def to_int(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int) or value is None:
+        return value
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            return None
+    return None
+
+
+def to_str(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        # coded value / range domains
+        return json.dumps(value, separators=(",", ":"))
+    return str(value)
+
+
+class ColumnarWriter:
+
+    BATCH_ROWS = 65536
+
+    def __init__(self, output_folder: str, format: str = "parquet", class_columns: dict = None, model_path: str = MODEL_PATH):
+        if not load_pyarrow():
+            raise ImportError("the columnar output needs pyarrow, pip install pyarrow")
+        if format not in FORMATS:
+            raise ValueError(f"unknown columnar format {format}, one of {', '.join(FORMATS)}")
+
+        self.format = format
+        self.folder = os.path.join(output_folder, format)
+        os.makedirs(self.folder, exist_ok=True)
+
+        types = model_types(model_path)
+        self.schemas = {
+            class_name: self.schema(columns, types) for class_name, columns in (class_columns or {}).items()
+        }
+        self.schemas[LINKS_NAME] = self.schema(LINK_COLUMNS, {})
+
+        # rows not written yet (item dicts, link lists) and the open file writers
+        self.buffers = {}
+        self.writers = {}
+        self.row_counts = {}
+
+    def schema(self, columns: list, types: dict):
+        arrow_types = {"core.Boolean": pa.bool_(), "core.Integer": pa.int64()}
+        return pa.schema([pa.field(column, arrow_types.get(types.get(column), pa.string())) for column in columns])
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.folder, name + FORMATS[self.format])
+
+    def add(self, class_name: str, item: dict):
+        buffer = self.buffers.setdefault(class_name, [])
+        buffer.append(item)
+        if len(buffer) >= self.BATCH_ROWS:
+            self.flush(class_name)
+
+    def add_link(self, row: list):
+        buffer = self.buffers.setdefault(LINKS_NAME, [])
+        buffer.append(row)
+        if len(buffer) >= self.BATCH_ROWS:
+            self.flush(LINKS_NAME)
+
+    def flush(self, name: str):
+        buffer = self.buffers.get(name)
+        if not buffer:
+            return
+        schema = self.schemas[name]
+        if name == LINKS_NAME:
+            columns = [list(column) for column in zip(*buffer)]
+        else:
+            columns = [[item.get(column) for item in buffer] for column in schema.names]
+
+        arrays = []
+        for field, values in zip(schema, columns):
+            if field.type == pa.int64():
+                # pyarrow would truncate floats, e.g. 1.5 -> 1
+                arrays.append(pa.array([to_int(value) for value in values], type=field.type))
+                continue
+            try:
+                # string and boolean columns mostly hold values of their type already, converted by pyarrow in one go
+                arrays.append(pa.array(values, type=field.type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                convert = to_bool if field.type == pa.bool_() else to_str
+                arrays.append(pa.array([convert(value) for value in values], type=field.type))
+        batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+        self.writer(name).write_batch(batch)
+        self.row_counts[name] = self.row_counts.get(name, 0) + batch.num_rows
+        buffer.clear()
+
+    def writer(self, name: str):
+        writer = self.writers.get(name)
+        if writer is None:
+            if self.format == "parquet":
+                writer = pq.ParquetWriter(self.path(name), self.schemas[name], compression="zstd")
+            else:
+                options = pa.ipc.IpcWriteOptions(compression="zstd")
+                writer = pa.ipc.new_file(self.path(name), self.schemas[name], options=options)
+            self.writers[name] = writer
+        return writer
+
+    def close(self):
+        for name in list(self.buffers):
+            self.flush(name)
+        for writer in self.writers.values():
+            writer.close()
+        # files of classes without rows in this scan, left by an earlier scan in the same folder
+        for name in self.schemas:
+            if name not in self.writers and os.path.exists(self.path(name)):
+                os.remove(self.path(name))
+        logging.info(
+            f"Columnar output ({self.format}): {', '.join(f'{name}={count}' for name, count in self.row_counts.items())} rows in {self.folder}"
+        )
+
+    @classmethod
+    def read_batches(cls, path: str, format: str):
+        if format == "parquet":
+            yield from pq.ParquetFile(path).iter_batches()
+        else:
+            with pa.ipc.open_file(path) as reader:
+                for index in range(reader.num_record_batches):
+                    yield reader.get_batch(index)
+
+    def merge(self, output_folders: list, dedupe_links: bool = False) -> int:
+        """
+        append the columnar files of several scans (the chunks of a sharded scan) to this writer, in the order of
+        output_folders. dedupe_links keeps only the first occurrence of each link. Returns the number of links dropped.
+        """
+        seen_links = set()
+        dropped = 0
+        for output_folder in output_folders:
+            for name in self.schemas:
+                path = os.path.join(output_folder, self.format, name + FORMATS[self.format])
+                if not os.path.exists(path):
+                    continue
+                for batch in self.read_batches(path, self.format):
+                    if name == LINKS_NAME and dedupe_links:
+                        keep = []
+                        for row in zip(*[column.to_pylist() for column in batch.columns]):
+                            keep.append(row not in seen_links)
+                            seen_links.add(row)
+                        dropped += keep.count(False)
+                        batch = batch.filter(pa.array(keep))
+                    if batch.num_rows:
+                        self.flush(name)
+                        self.writer(name).write_batch(batch)
+                        self.row_counts[name] = self.row_counts.get(name, 0) + batch.num_rows
+        return dropped
@@ -0,0 +1,60 @@
+"""
+File: id_registry.py
+Version: 1.4
+
+Description:
+Registries of the keys CDGCWriter already wrote (class + externalId of each object, source + target +
+association of each link), so duplicates are dropped when they are written instead of being rejected
+by CDGC at load time.
+
+HashRegistry keeps a 64 bit blake2b hash of every key, about 70 bytes per key. The chance that two
+different keys of a scan share a hash is tiny (about 1 in 400000 for a scan of 10 million objects).
+
+BloomRegistry is a Bloom filter sized for an expected number of keys and a false positive rate, about
+4 bytes per key at 1 in a million. A false positive drops an object that was not a duplicate, so it is
+meant for scans too big to keep a hash of every key in memory.
+"""
+
+import hashlib
+import math
+
+
+def key_digest(key: str, size: int) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf8"), digest_size=size).digest(), "little")
+
+
+class HashRegistry:
+
+    def __init__(self):
+        self.keys = set()
+
+    def add(self, key: str) -> bool:
+        """register key, returns False if it was registered before"""
+        digest = key_digest(key, 8)
+        if digest in self.keys:
+            return False
+        self.keys.add(digest)
+        return True
+
+
+class BloomRegistry:
+
+    def __init__(self, capacity: int = 10000000, error_rate: float = 1e-6):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, key: str) -> bool:
+        """register key, returns False if it was (probably) registered before"""
+        # double hashing, the k bit positions are derived from the two halves of one 128 bit digest
+        digest = key_digest(key, 16)
+        h1 = digest & 0xFFFFFFFFFFFFFFFF
+        h2 = digest >> 64 | 1
+        new = False
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % self.size
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not self.bits[byte] & mask:
+                self.bits[byte] |= mask
+                new = True
+        return new
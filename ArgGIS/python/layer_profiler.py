@@ -0,0 +1,146 @@
+"""
+File: layer_profiler.py
+Version: 1.4
+
+Description:
+Record count and extent of the layers of a scan (--profile-layers), written as the recordCount and
+dataExtent attributes of each layer. Every queryable layer gets one query,
+    {layer url}/query?where=1=1&returnCountOnly=true&returnExtentOnly=true&f=json
+(count only for tables, and again count only when a server cannot answer both in one query).
+
+Queries run in their own pool of --profile-concurrency threads while the crawl goes on, through the
+http client of the scan: they share its per host limit, retries, budget and response cache (--cache-dir,
+so a rescan within --cache-ttl sends no count query at all). A query not answered within --profile-timeout
+seconds is dropped and its layer written without a count. The crawler never waits for a query: a layer
+whose count is not known yet when it is written is queued with the rows written after it, and the queue is
+written in crawl order as the counts of its layers come in, at the latest at the end of the crawl.
+"""
+
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from arcgis_http import ArcGISClient
+
+PROFILED = "profiled"
+TIMED_OUT = "timed out"
+FAILED = "failed"
+NOT_QUERYABLE = "not queryable"
+
+
+class LayerProfiler:
+
+    def __init__(self, client: ArcGISClient, concurrency: int = 4, timeout: float = 30.0):
+        self.client = client
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.pool = None
+        # query of each layer by layer url, a layer written twice is queried once
+        self.profiles = {}
+        self.counts = {PROFILED: 0, TIMED_OUT: 0, FAILED: 0, NOT_QUERYABLE: 0}
+        self.lock = threading.Lock()
+
+    def start(self):
+        logging.info(f"Layer profiling: {self.concurrency} threads, --profile-timeout {self.timeout:g}s")
+        limit = self.client.max_per_host
+        if self.concurrency > limit:
+            logging.warning(f"Layer profiling: {self.concurrency} threads but at most {limit} requests per host, raise --max-per-host to send more count queries at a time")
+        self.pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix="profile")
+
+    def stop(self):
+        if self.pool is not None:
+            # queries of layers that will not be written anymore (scan stopped by its budget)
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def queryable(self, layer_obj: dict) -> bool:
+        if layer_obj.get("type") == "Group Layer":
+            return False
+        # MapServer layers list their operations, e.g. "Map,Query,Data"
+        capabilities = layer_obj.get("capabilities")
+        return not isinstance(capabilities, str) or "query" in capabilities.lower()
+
+    def submit(self, layer_url: str, layer_obj):
+        """start the count query of a layer, if it has none yet"""
+        if not isinstance(layer_obj, dict):
+            return
+        with self.lock:
+            if layer_url in self.profiles:
+                return
+            if not self.queryable(layer_obj):
+                self.profiles[layer_url] = None
+                self.counts[NOT_QUERYABLE] += 1
+                return
+            if self.pool is None:
+                # with the first layer, a scan that only lists the server starts no thread
+                self.start()
+            # tables have no geometry, and no extent
+            extent = bool(layer_obj.get("geometryType"))
+            self.profiles[layer_url] = self.pool.submit(self.query, layer_url, extent)
+
+    def ready(self, layer_url: str) -> bool:
+        """False while the query of the layer is running"""
+        with self.lock:
+            future = self.profiles.get(layer_url)
+        return future is None or future.done()
+
+    def result(self, layer_url: str) -> dict:
+        """{"recordCount": ..., "dataExtent": ...} of a layer, waits for its query. Empty if the layer was not profiled"""
+        with self.lock:
+            future = self.profiles.get(layer_url)
+        if future is None or future.cancelled():
+            return {}
+        return future.result()
+
+    def query(self, layer_url: str, extent: bool) -> dict:
+        # the timeout starts when the query is sent, not while it waits for a thread
+        deadline = time.monotonic() + self.timeout
+        params = {"where": "1=1", "returnCountOnly": "true", "f": "json"}
+
+        result = None
+        if extent:
+            result = self.client.get_json(layer_url + "/query", params={**params, "returnExtentOnly": "true"}, log_errors=False, kind="profile", deadline=deadline)
+        if not isinstance(result, dict) or "count" not in result:
+            # an error document from a server that cannot count and measure in one query, or a table
+            result = self.client.get_json(layer_url + "/query", params=params, log_errors=False, kind="profile", deadline=deadline)
+
+        profile = {}
+        if isinstance(result, dict) and isinstance(result.get("count"), int):
+            profile["recordCount"] = result["count"]
+            profile["dataExtent"] = self.format_extent(result.get("extent"))
+            status = PROFILED
+        elif self.client.budget is not None and self.client.budget.exhausted():
+            # the scan stopped at its budget, the layer is written without a count
+            status = FAILED
+        elif time.monotonic() >= deadline:
+            logging.warning(f"\t\t- Count query of {layer_url} not answered within --profile-timeout {self.timeout:g}s, layer written without a count")
+            status = TIMED_OUT
+        else:
+            message = result.get("error", {}).get("message") if isinstance(result, dict) and isinstance(result.get("error"), dict) else None
+            logging.warning(f"\t\t- Count query of {layer_url} failed{': ' + message if message else ''}, layer written without a count")
+            status = FAILED
+
+        with self.lock:
+            self.counts[status] += 1
+        return profile
+
+    def format_extent(self, extent) -> str:
+        # xmin,ymin,xmax,ymax (wkid N). An empty layer has a NaN or null extent
+        if not isinstance(extent, dict):
+            return ""
+        bounds = [extent.get(key) for key in ("xmin", "ymin", "xmax", "ymax")]
+        if not all(isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value) for value in bounds):
+            return ""
+        text = ",".join(str(value) for value in bounds)
+        spatial_reference = extent.get("spatialReference")
+        if isinstance(spatial_reference, dict):
+            wkid = spatial_reference.get("latestWkid") or spatial_reference.get("wkid")
+            if wkid:
+                text += f" (wkid {wkid})"
+        return text
+
+    def describe(self) -> str:
+        with self.lock:
+            return ", ".join(f"{count} {status}" for status, count in self.counts.items())
@@ -0,0 +1,406 @@
+"""
+File: mock_arcgis_server.py
+Version: 1.4
+
+Description:
+Local stand-in for an ArcGIS REST services directory, used to time the crawler without
+hitting a real server. The catalog is synthetic and fully determined by the options, and every
+response is delayed by --latency (plus up to --jitter) to simulate the network round trip.
+
+--error-rate answers that fraction of the requests with a 503, or a 429 with Retry-After, to exercise
+retries. Which requests fail, and the jitter of each request, only depend on --seed, the path and how
+many times that path was requested, so a run is reproducible whatever order concurrent requests arrive in.
+
+--capacity N simulates a small server that can only work on N requests at a time: with more requests in
+flight every response is slowed down in proportion, and past 2N requests in flight the server answers
+503 straight away.
+
+Layers answer count and extent queries ({layer}/query?returnCountOnly=true&returnExtentOnly=true) with a
+record count fixed by the service name and layer id. One layer in ten is a huge one of over 10 million
+records, --query-latency adds that many seconds to each of its queries.
+
+The server is also a portal at /portal: sharing/rest/portals/self and a sharing/rest/search listing an item
+for every service, a second item for every tenth service and a Web Map item per folder, in pages of num
+results. --search-latency adds that many seconds to every search page, portal searches are slow.
+
+Usage:
+    python mock_arcgis_server.py --port 8099 --services 50 --layers 10 --fields 20 --latency 0.05
+    python mock_arcgis_server.py --port 8099 --latency 0.05 --jitter 0.1 --error-rate 0.02 --seed 7
+
+    the catalog is then available at http://127.0.0.1:8099/arcgis/rest/services
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+ROOT_PATH = "/arcgis/rest/services"
+PORTAL_PATH = "/portal"
+PORTAL_ID = "MockOrg0000000000"
+SERVICE_TYPES = ["FeatureServer", "MapServer"]
+
+
+class MockCatalog:
+
+    # layers with more records than this answer their queries --query-latency slower
+    HUGE_RECORDS = 10000000
+
+    def __init__(self, services: int = 20, layers: int = 5, fields: int = 10, folders: int = 2, bulk_layers: bool = True, subfolders: int = 0, symbols: int = 0, groups: int = 0):
+        self.services = services
+        # layer 0 of each MapServer is a group layer holding the next `groups` layers
+        self.groups = min(groups, max(0, layers - 1))
+        # unique value classes in the renderer of each layer, real layers often carry big drawingInfo blocks
+        self.symbols = symbols
+        self.layers = layers
+        self.fields = fields
+        self.folders = [f"Folder_{i:02d}" for i in range(folders)]
+        # nested folders, listed by their parent with their full path like "Folder_00/Sub_00"
+        self.subfolders = [f"{folder}/Sub_{i:02d}" for folder in self.folders for i in range(subfolders)]
+        # older ArcGIS servers have no {service}/layers endpoint
+        self.bulk_layers = bulk_layers
+        self.edit_date = 1700000000000
+
+    def service_refs(self) -> list:
+        # services are dealt round robin between the root and each folder, folder services are
+        # named "<folder>/<service>" like a real ArcGIS server lists them
+        containers = [""] + self.folders + self.subfolders
+        refs = []
+        for i in range(self.services):
+            folder = containers[i % len(containers)]
+            name = f"{folder}/Service_{i:04d}" if folder else f"Service_{i:04d}"
+            refs.append({"name": name, "type": SERVICE_TYPES[i % len(SERVICE_TYPES)], "folder": folder})
+        return refs
+
+    def map_services(self) -> set:
+        return {ref["name"] for ref in self.service_refs() if ref["type"] == "MapServer"}
+
+    def listing(self, folder: str) -> dict:
+        services = [
+            {"name": ref["name"], "type": ref["type"]} for ref in self.service_refs() if ref["folder"] == folder
+        ]
+        if folder:
+            folders = [sub for sub in self.subfolders if sub.rsplit("/", 1)[0] == folder]
+        else:
+            folders = self.folders
+        return {"currentVersion": 11.1, "folders": folders, "services": services}
+
+    def service(self, name: str, service_type: str) -> dict:
+        doc = {
+            "currentVersion": 11.1,
+            "serviceDescription": f"synthetic {service_type} {name}",
+            "description": f"{name} description",
+            "copyrightText": "mock",
+            "hasVersionedData": False,
+            "maxRecordCount": 2000,
+            "supportedQueryFormats": "JSON",
+            "units": "esriMeters",
+            "layers": [{"id": i, "name": f"{name}_layer_{i}"} for i in range(self.layers)],
+        }
+        if service_type == "MapServer" and self.groups:
+            for layer_ref in doc["layers"]:
+                layer_ref["parentLayerId"] = 0 if 0 < layer_ref["id"] <= self.groups else -1
+                layer_ref["subLayerIds"] = list(range(1, self.groups + 1)) if layer_ref["id"] == 0 else None
+        # hosted feature services publish when they were last edited
+        if service_type == "FeatureServer":
+            doc["serviceItemId"] = hashlib.md5(name.encode("utf8")).hexdigest()
+            # every service was last edited at its own time, up to a day before edit_date
+            offset = int(doc["serviceItemId"][:8], 16) % 86400
+            doc["editingInfo"] = {"lastEditDate": self.edit_date - offset * 1000}
+        return doc
+
+    def layer(self, name: str, layer_id: int) -> dict:
+        if layer_id == 0 and self.groups and name in self.map_services():
+            return {
+                "id": 0,
+                "name": f"{name}_group",
+                "type": "Group Layer",
+                "description": "",
+                "subLayers": [{"id": i, "name": f"{name}_layer_{i}"} for i in range(1, self.groups + 1)],
+                "fields": None,
+            }
+
+        doc = {
+            "id": layer_id,
+            "name": f"{name}_layer_{layer_id}",
+            "type": "Feature Layer",
+            "description": "",
+            "geometryType": "esriGeometryPolygon",
+            "maxRecordCount": 2000,
+            "supportsStatistics": True,
+            "supportsAdvancedQueries": True,
+            "fields": [
+                {
+                    "name": f"FIELD_{f}",
+                    "type": "esriFieldTypeString",
+                    "alias": f"Field {f}",
+                    "length": 50,
+                    "nullable": True,
+                    "editable": True,
+                    "domain": None,
+                    "defaultValue": None,
+                }
+                for f in range(self.fields)
+            ],
+        }
+        if self.symbols:
+            doc["drawingInfo"] = {
+                "renderer": {
+                    "type": "uniqueValue",
+                    "field1": "FIELD_0",
+                    "uniqueValueInfos": [
+                        {
+                            "value": f"class {s}",
+                            "label": f"Class {s}",
+                            "symbol": {
+                                "type": "esriSFS",
+                                "style": "esriSFSSolid",
+                                "color": [s % 256, (s * 7) % 256, (s * 13) % 256, 255],
+                                "outline": {"type": "esriSLS", "style": "esriSLSSolid", "color": [110, 110, 110, 255], "width": 0.7},
+                            },
+                        }
+                        for s in range(self.symbols)
+                    ],
+                },
+                "transparency": 0,
+            }
+        return doc
+
+    def record_count(self, name: str, layer_id: int) -> int:
+        digest = hashlib.md5(f"{name}/{layer_id}".encode("utf8")).digest()
+        count = int.from_bytes(digest[:4], "big") % 100000
+        return self.HUGE_RECORDS + count * 1000 if digest[4] % 10 == 0 else count
+
+    def query(self, name: str, layer_id: int, params: dict) -> dict:
+        layer = self.layer(name, layer_id)
+        if layer["type"] == "Group Layer":
+            return {"error": {"code": 400, "message": "Requested operation is not supported by this service.", "details": []}}
+        if params.get("returnCountOnly") != "true":
+            return {"error": {"code": 400, "message": "Only count queries are supported by the mock server.", "details": []}}
+        doc = {"count": self.record_count(name, layer_id)}
+        if params.get("returnExtentOnly") == "true":
+            if doc["count"]:
+                offset = layer_id * 1000.0
+                doc["extent"] = {"xmin": offset, "ymin": 0.0 - offset, "xmax": offset + 500.5, "ymax": 250.25 - offset, "spatialReference": {"wkid": 102100, "latestWkid": 3857}}
+            else:
+                doc["extent"] = {"xmin": "NaN", "ymin": "NaN", "xmax": "NaN", "ymax": "NaN", "spatialReference": {"wkid": 102100, "latestWkid": 3857}}
+        return doc
+
+    def portal_items(self, base_url: str) -> list:
+        items = []
+        for i, ref in enumerate(self.service_refs()):
+            url = f"{base_url}{ROOT_PATH}/{ref['name']}/{ref['type']}"
+            item_type = "Feature Service" if ref["type"] == "FeatureServer" else "Map Service"
+            items.append({"id": f"item{i:05d}", "title": ref["name"], "type": item_type, "url": url})
+            if i % 10 == 9:
+                # a copy of the item, same service
+                items.append({"id": f"copy{i:05d}", "title": f"{ref['name']} (copy)", "type": item_type, "url": url})
+        for i, folder in enumerate(self.folders):
+            items.insert(i * 7, {"id": f"map{i:05d}", "title": f"{folder} map", "type": "Web Map", "url": None})
+        return items
+
+    def search(self, params: dict, base_url: str) -> dict:
+        items = self.portal_items(base_url)
+        start = int(params.get("start", 1))
+        num = int(params.get("num", 10))
+        results = items[start - 1: start - 1 + num]
+        next_start = start + num if start - 1 + num < len(items) else -1
+        return {"query": params.get("q", ""), "total": len(items), "start": start, "num": num, "nextStart": next_start, "results": results}
+
+    def lookup(self, path: str, params: dict = None, base_url: str = ""):
+        """return the document for a REST path and its query parameters, or None if the catalog has nothing there"""
+        if path == PORTAL_PATH + "/sharing/rest/portals/self":
+            return {"id": PORTAL_ID, "name": "Mock portal", "isPortal": False}
+        if path == PORTAL_PATH + "/sharing/rest/search":
+            return self.search(params or {}, base_url)
+        if not path.startswith(ROOT_PATH):
+            return None
+        parts = [p for p in path[len(ROOT_PATH):].split("/") if p]
+
+        if not parts:
+            return self.listing("")
+        if "/".join(parts) in self.folders + self.subfolders:
+            return self.listing("/".join(parts))
+
+        # folder services have a name of several parts, followed by the service type
+        services = {ref["name"]: ref["type"] for ref in self.service_refs()}
+        for i in range(1, len(parts)):
+            if services.get("/".join(parts[:i])) == parts[i]:
+                parts = ["/".join(parts[:i])] + parts[i:]
+                break
+        else:
+            return None
+        if len(parts) == 2:
+            return self.service(parts[0], parts[1])
+        if len(parts) == 3 and parts[2].isdigit() and int(parts[2]) < self.layers:
+            return self.layer(parts[0], int(parts[2]))
+        if len(parts) == 4 and parts[2].isdigit() and int(parts[2]) < self.layers and parts[3] == "query":
+            return self.query(parts[0], int(parts[2]), params or {})
+        if len(parts) == 3 and parts[2] == "layers" and self.bulk_layers:
+            return {"layers": [self.layer(parts[0], i) for i in range(self.layers)], "tables": []}
+        return None
+
+
+class MockArcGISServer:
+    """threaded http server serving a MockCatalog, can be run in the background of a benchmark"""
+
+    def __init__(self, catalog: MockCatalog, port: int = 0, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: int = 0, capacity: int = 0, query_latency: float = 0.0, search_latency: float = 0.0):
+        self.catalog = catalog
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+        self.capacity = capacity
+        self.query_latency = query_latency
+        self.search_latency = search_latency
+        self.request_count = 0
+        self.error_count = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.path_counts = {}
+        self.count_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{ROOT_PATH}"
+
+    def reset(self):
+        # start the next run with the same jitter and errors as the previous one
+        with self.count_lock:
+            self.path_counts = {}
+            self.peak_in_flight = 0
+
+    def draw(self, path: str, attempt: int, purpose: str) -> float:
+        # reproducible number in [0, 1) for the n-th request of a path
+        digest = hashlib.sha256(f"{self.seed}:{purpose}:{path}:{attempt}".encode("utf8")).digest()
+        return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                path = url.path.rstrip("/")
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                with server.count_lock:
+                    server.request_count += 1
+                    attempt = server.path_counts.get(path, 0)
+                    server.path_counts[path] = attempt + 1
+                    server.in_flight += 1
+                    in_flight = server.in_flight
+                    server.peak_in_flight = max(server.peak_in_flight, in_flight)
+                try:
+                    self.respond(path, params, attempt, in_flight)
+                finally:
+                    with server.count_lock:
+                        server.in_flight -= 1
+
+            def respond(self, path: str, params: dict, attempt: int, in_flight: int):
+                if server.capacity and in_flight > 2 * server.capacity:
+                    with server.count_lock:
+                        server.error_count += 1
+                    self.send_error(503)
+                    return
+
+                delay = server.latency + server.jitter * server.draw(path, attempt, "jitter")
+                if server.capacity:
+                    delay *= max(1.0, in_flight / server.capacity)
+                if delay:
+                    time.sleep(delay)
+
+                if server.error_rate and server.draw(path, attempt, "error") < server.error_rate:
+                    with server.count_lock:
+                        server.error_count += 1
+                    if server.draw(path, attempt, "status") < 0.5:
+                        self.send_response(429)
+                        self.send_header("Retry-After", "0")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                    else:
+                        self.send_error(503)
+                    return
+
+                doc = server.catalog.lookup(path, params, server.url[: -len(ROOT_PATH)])
+                if doc is None:
+                    self.send_error(404)
+                    return
+                if server.query_latency and doc.get("count", 0) > server.catalog.HUGE_RECORDS:
+                    time.sleep(server.query_latency)
+                if server.search_latency and path == PORTAL_PATH + "/sharing/rest/search":
+                    time.sleep(server.search_latency)
+
+                body = json.dumps(doc).encode("utf8")
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f"mock arcgis: {format % args}")
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic ArcGIS REST catalog")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--services", type=int, default=20)
+    parser.add_argument("--folders", type=int, default=2)
+    parser.add_argument("--subfolders", type=int, default=0, help="nested folders in each folder")
+    parser.add_argument("--layers", type=int, default=5, help="layers per service")
+    parser.add_argument("--symbols", type=int, default=0, help="renderer classes in the drawingInfo of each layer")
+    parser.add_argument("--groups", type=int, default=0, help="sub layers of the group layer 0 of each MapServer")
+    parser.add_argument("--fields", type=int, default=10, help="fields per layer")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds added on top of --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of the requests answered with a 503 or 429")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the jitter and the injected errors")
+    parser.add_argument("--capacity", type=int, default=0, help="requests the server works on at a time, 0 = no limit")
+    parser.add_argument("--query-latency", type=float, default=0.0, help="seconds added to the count queries of the huge layers")
+    parser.add_argument("--search-latency", type=float, default=0.0, help="seconds added to every portal search page")
+    parser.add_argument("--no-bulk-layers", action="store_true", help="do not serve the {service}/layers endpoint")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)-5s - %(message)s')
+
+    catalog = MockCatalog(args.services, args.layers, args.fields, args.folders, not args.no_bulk_layers, args.subfolders, args.symbols, args.groups)
+    server = MockArcGISServer(catalog, args.port, args.latency, args.jitter, args.error_rate, args.seed, args.capacity, args.query_latency, args.search_latency)
+    logging.info(f"serving mock catalog at {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
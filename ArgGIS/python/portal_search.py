@@ -0,0 +1,159 @@
+"""
+File: portal_search.py
+Version: 1.4
+
+Description:
+Service discovery through the search API of an ArcGIS portal (--portal), ArcGIS Online or Enterprise,
+instead of the rest/services listing of one server:
+    {portal}/sharing/rest/search?q=...&start=1&num=100&sortField=created&sortOrder=asc&f=json
+finds the Feature Service and Map Service items of the organization of the portal (the orgid given by
+{portal}/sharing/rest/portals/self), narrowed down with --portal-query. The url of each item is cut into
+the server url, folder, name and type the crawler reads the service with, a service shared as several
+items (views, copies) is crawled once.
+
+The first page gives the number of results, the next --portal-prefetch pages are then requested at the
+same time and kept that many pages ahead of the crawl: the services of a page are crawled while the next
+pages are read. Results are sorted by creation date, so an item created during the scan lands on the last
+page instead of shifting the others. The search API returns the first 10000 results of a query at most,
+a bigger organization is scanned with several --portal-query (e.g. owner:..., tags:...).
+"""
+
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from arcgis_http import ArcGISClient
+
+# item types of the services the crawler reads, and the service types in their urls
+ITEM_TYPES = ["Feature Service", "Map Service"]
+SERVICE_TYPES = ["FeatureServer", "MapServer"]
+
+
+def split_service_url(url: str):
+    """
+    (server url, folder, service name, service type) of a service url, e.g. https://host/arcgis/rest/services/Planning/Zoning/MapServer/3
+    gives (https://host/arcgis/rest/services, Planning, Planning/Zoning, MapServer). None for anything else
+    """
+    parts = urlsplit(url)
+    path = parts.path.rstrip("/")
+    marker = "/rest/services/"
+    index = path.lower().find(marker)
+    if not parts.netloc or index < 0:
+        return None
+    names = path[index + len(marker):].split("/")
+    for position, part in enumerate(names):
+        service_type = {value.lower(): value for value in SERVICE_TYPES}.get(part.lower())
+        if service_type and position > 0:
+            name = "/".join(names[:position])
+            folder = name.rsplit("/", 1)[0] if "/" in name else ""
+            return f"{parts.scheme}://{parts.netloc}{path[:index + len(marker) - 1]}", folder, name, service_type
+    return None
+
+
+class PortalSearch:
+
+    PAGE_SIZE = 100
+    # results of one query the search API pages through
+    MAX_RESULTS = 10000
+
+    def __init__(self, client: ArcGISClient, portal_url: str, query: str = "", prefetch: int = 2):
+        self.client = client
+        self.portal_url = portal_url.rstrip("/")
+        self.query = query
+        self.prefetch = max(1, prefetch)
+
+        self.items = 0
+        self.services_found = 0
+        self.duplicates = 0
+        self.other_items = 0
+
+    def search_query(self) -> str:
+        q = "(" + " OR ".join(f'type:"{item_type}"' for item_type in ITEM_TYPES) + ")"
+        if self.query:
+            q = f"({self.query}) AND {q}"
+        if "orgid:" not in self.query:
+            # the whole of ArcGIS Online otherwise
+            portal_obj = self.client.get_json(self.portal_url + "/sharing/rest/portals/self", params={"f": "json"}, kind="search")
+            if isinstance(portal_obj, dict) and portal_obj.get("id"):
+                q = f"{q} AND orgid:{portal_obj['id']}"
+            else:
+                logging.warning(f"organization of portal {self.portal_url} unknown, searching all of its items")
+        return q
+
+    def page(self, q: str, start: int):
+        params = {"q": q, "start": start, "num": self.PAGE_SIZE, "sortField": "created", "sortOrder": "asc", "f": "json"}
+        page_obj = self.client.get_json(self.portal_url + "/sharing/rest/search", params=params, kind="search")
+        if isinstance(page_obj, dict) and "error" in page_obj:
+            logging.error(f"portal search failed at result {start}: {page_obj['error']}")
+            return None
+        return page_obj
+
+    def pages(self):
+        """results of each page of the search in order, the next pages are read meanwhile"""
+        q = self.search_query()
+        logging.info(f"Portal search: {q}")
+        first = self.page(q, 1)
+        if first is None:
+            logging.error(f"cannot search portal {self.portal_url}")
+            return
+        total = first.get("total", 0)
+        logging.info(f"Portal search: {total} items")
+        if total > self.MAX_RESULTS:
+            logging.warning(f"Portal search: only the first {self.MAX_RESULTS} of {total} items can be read, narrow the search down with --portal-query")
+        if first.get("nextStart", -1) == -1:
+            yield first.get("results") or []
+            return
+
+        starts = iter(range(1 + self.PAGE_SIZE, min(total, self.MAX_RESULTS) + 1, self.PAGE_SIZE))
+        pool = ThreadPoolExecutor(self.prefetch, thread_name_prefix="portal-search")
+        try:
+            # the next pages are on their way while the services of the first one are crawled
+            window = deque()
+            for start in starts:
+                window.append((start, pool.submit(self.page, q, start)))
+                if len(window) >= self.prefetch:
+                    break
+            yield first.get("results") or []
+            while window:
+                start, future = window.popleft()
+                page_obj = future.result()
+                next_start = next(starts, None)
+                if next_start is not None:
+                    window.append((next_start, pool.submit(self.page, q, next_start)))
+                if page_obj is None:
+                    # one page failing does not stop the others, its services are just not scanned
+                    logging.error(f"portal search page at result {start} could not be read, {self.PAGE_SIZE} items skipped")
+                    continue
+                yield page_obj.get("results") or []
+                if page_obj.get("nextStart", -1) == -1:
+                    # fewer results than the first page said (items deleted meanwhile)
+                    return
+        finally:
+            # the crawl may stop early (--limit, scan budget), pages not read yet are not requested
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def services(self):
+        """(server url, folder, service_ref) of every service found, each one once"""
+        seen = set()
+        for results in self.pages():
+            for item in results:
+                self.items += 1
+                parsed = split_service_url(item.get("url") or "") if item.get("type") in ITEM_TYPES else None
+                if parsed is None:
+                    self.other_items += 1
+                    continue
+                server_url, folder, name, service_type = parsed
+                key = f"{server_url}/{name}/{service_type}"
+                if key in seen:
+                    self.duplicates += 1
+                    continue
+                seen.add(key)
+                self.services_found += 1
+                yield server_url, folder, {"name": name, "type": service_type}
+
+    def describe(self) -> str:
+        return (
+            f"{self.items} items read, {self.services_found} services, {self.duplicates} items of a service already found, "
+            f"{self.other_items} items without a service url"
+        )
@@ -0,0 +1,47 @@
+"""
+File: row_buffer.py
+Version: 1.4
+
+Description:
+In-memory rows of one CDGC class, kept until the csv file of the class is written at the end of the scan
+(default mode and --zip-direct). Rows are stored column by column, one list per attribute, instead of
+one dict per row repeating the attribute names: 2 million fields take 860 MB instead of 1.9 GB
+(measured with benchmark_writer.py on a synthetic catalog).
+
+The string values of columns with few distinct values (field types, flags, field names shared by many
+layers) are interned, so each distinct value is kept once whatever the number of rows. Values that are not
+strings are kept as they are, except dicts and lists (coded value domains) which are kept as the text the
+csv file gets, str(value), instead of as a tree of parsed json objects.
+"""
+
+import sys
+
+
+class RowBuffer:
+
+    def __init__(self, columns: list, interned: set = frozenset()):
+        self.columns = columns
+        self.data = [[] for _ in columns]
+        # (column, append of its list), the interned columns apart
+        self.plain = [(column, values.append) for column, values in zip(columns, self.data) if column not in interned]
+        self.interned = [(column, values.append) for column, values in zip(columns, self.data) if column in interned]
+
+    def __len__(self) -> int:
+        return len(self.data[0]) if self.data else 0
+
+    def append(self, item: dict):
+        # a missing attribute is an empty value, like csv.DictWriter writes it
+        get = item.get
+        for column, add in self.plain:
+            add(get(column, ""))
+        for column, add in self.interned:
+            value = get(column, "")
+            if value.__class__ is str:
+                value = sys.intern(value)
+            elif isinstance(value, (dict, list)):
+                value = sys.intern(str(value))
+            add(value)
+
+    def rows(self):
+        """the rows as lists of values, in column order"""
+        return zip(*self.data)
@@ -0,0 +1,54 @@
+"""
+File: scan_budget.py
+Version: 1.4
+
+Description:
+Time and request budget of a scan (--max-duration, --max-requests), for scans that have to fit in a fixed
+window. ArcGISClient asks the budget before sending each request, retries included, and no request is sent
+once it is spent. The crawler then stops at the first service it could not read completely and writes the
+zip file with everything read so far, so a scan cut short still produces a valid, consistent output.
+"""
+
+import logging
+import threading
+import time
+
+
+class ScanBudget:
+
+    def __init__(self, max_duration: float = 0, max_requests: int = 0):
+        self.max_duration = max_duration
+        self.max_requests = max_requests
+        self.started = time.monotonic()
+        # time.monotonic() value after which no request is sent, None without --max-duration
+        self.deadline = self.started + max_duration if max_duration > 0 else None
+        self.requests = 0
+        # why the budget is spent, None while it is not
+        self.reason = None
+        self.lock = threading.Lock()
+
+    def check(self) -> bool:
+        # callers hold the lock
+        if self.reason is None:
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                self.reason = f"--max-duration {self.max_duration:g}s"
+            elif self.max_requests > 0 and self.requests >= self.max_requests:
+                self.reason = f"--max-requests {self.max_requests}"
+            if self.reason is not None:
+                logging.warning(f"Scan budget reached ({self.reason}) after {self.requests} requests, no more requests are sent")
+        return self.reason is not None
+
+    def exhausted(self) -> bool:
+        with self.lock:
+            return self.check()
+
+    def spend(self) -> bool:
+        """count one request about to be sent, returns False (and counts nothing) when the budget is spent"""
+        with self.lock:
+            if self.check():
+                return False
+            self.requests += 1
+            return True
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
@@ -0,0 +1,117 @@
+"""
+File: scan_filter.py
+Version: 1.4
+
+Description:
+Include / exclude filters of a targeted scan (--include, --exclude), applied to the folder and service
+listings before any service or layer request is sent.
+
+A filter is field=pattern, field being
+    folder  folder path of the service, e.g. Planning/Zoning. Root services have the folder "".
+            A folder pattern also matches the sub folders of a matching folder.
+    name    service name without its folder
+    type    service type, FeatureServer or MapServer
+The pattern is a glob (Planning*, *Parcels*), or a regular expression when it starts with re:
+(re:^(Planning|Transport)$). Matching is case insensitive.
+
+Includes of the same field are alternatives, includes of different fields must all match, a service
+matching any exclude is dropped. Folders whose services are all filtered out are not listed at all.
+"""
+
+import fnmatch
+import re
+
+FILTER_FIELDS = ["folder", "name", "type"]
+
+
+class Pattern:
+
+    def __init__(self, text: str):
+        self.text = text
+        if text.startswith("re:"):
+            self.glob = None
+            self.regex = re.compile(text[3:], re.IGNORECASE)
+        else:
+            self.glob = text.lower()
+            self.regex = re.compile(fnmatch.translate(text), re.IGNORECASE)
+
+    def match(self, value: str) -> bool:
+        if self.glob is None:
+            return self.regex.search(value) is not None
+        return self.regex.match(value) is not None
+
+    def may_match_below(self, folder: str) -> bool:
+        """False if no sub folder of folder can match, e.g. Planning/Zoning* below Transport, Folder_01* below Folder_00"""
+        if self.glob is None:
+            # no such guarantee from a regular expression
+            return True
+        below = folder.lower() + "/" if folder else ""
+        # * ? and [] also match /, only the text before the first wildcard is known
+        wildcards = [index for index in (self.glob.find(char) for char in "*?[") if index >= 0]
+        if not wildcards:
+            return len(self.glob) > len(below) and self.glob.startswith(below)
+        prefix = self.glob[:min(wildcards)]
+        return below.startswith(prefix) or prefix.startswith(below)
+
+
+class ServiceFilter:
+
+    def __init__(self, includes: list = None, excludes: list = None):
+        self.includes = self.parse(includes or [])
+        self.excludes = self.parse(excludes or [])
+
+    def parse(self, filters: list) -> dict:
+        patterns = {}
+        for text in filters:
+            field, sep, pattern = text.partition("=")
+            if not sep or field not in FILTER_FIELDS or not pattern:
+                raise ValueError(f"invalid filter {text!r}, expected field=pattern with field one of {', '.join(FILTER_FIELDS)}")
+            try:
+                patterns.setdefault(field, []).append(Pattern(pattern))
+            except re.error as e:
+                raise ValueError(f"invalid regular expression in filter {text!r}: {e}") from None
+        return patterns
+
+    def __bool__(self) -> bool:
+        return bool(self.includes or self.excludes)
+
+    def describe(self) -> str:
+        return " ".join(
+            [f"include {field}={pattern.text}" for field, patterns in self.includes.items() for pattern in patterns]
+            + [f"exclude {field}={pattern.text}" for field, patterns in self.excludes.items() for pattern in patterns]
+        )
+
+    def folder_matches(self, patterns: list, folder: str) -> bool:
+        # the folder itself or any of its parent folders
+        parts = folder.split("/") if folder else [""]
+        paths = ["/".join(parts[: index + 1]) for index in range(len(parts))]
+        return any(pattern.match(path) for pattern in patterns for path in paths)
+
+    def keep(self, folder: str, service_ref: dict) -> bool:
+        """True if the service, listed in folder, is scanned"""
+        values = {"name": service_ref["name"].rsplit("/", 1)[-1], "type": service_ref.get("type", "")}
+
+        for field, patterns in self.includes.items():
+            if field == "folder":
+                if not self.folder_matches(patterns, folder):
+                    return False
+            elif not any(pattern.match(values[field]) for pattern in patterns):
+                return False
+
+        for field, patterns in self.excludes.items():
+            if field == "folder":
+                if self.folder_matches(patterns, folder):
+                    return False
+            elif any(pattern.match(values[field]) for pattern in patterns):
+                return False
+        return True
+
+    def list_folder(self, folder: str) -> bool:
+        """False if no service of the folder or of its sub folders can be kept, the folder is then not read"""
+        if self.folder_matches(self.excludes.get("folder", []), folder):
+            return False
+        patterns = self.includes.get("folder")
+        if not patterns or self.folder_matches(patterns, folder):
+            return True
+        # the folder may hold a matching sub folder, e.g. Planning for Planning/Zoning*
+        return any(pattern.may_match_below(folder) for pattern in patterns)
@@ -0,0 +1,219 @@
+"""
+File: scan_metrics.py
+Version: 1.4
+
+Description:
+Instrumentation of a scan, to tell whether a slow run is spent waiting for the server, decoding json
+or writing the output. ScanMetrics collects, per endpoint kind (server, folder, service, layers, layer, profile):
+    - request count, errors, retries, cache hits and bytes received
+    - a latency histogram of the requests
+    - json decode time
+and for the whole scan the writer time, the finalize time and the slowest services.
+
+The report is written at the end of the scan as json, or as a Prometheus textfile (.prom) for the
+node_exporter textfile collector.
+"""
+
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+KIND_COUNTERS = ["requests", "errors", "retries", "cache_hits", "bytes", "latency_sum", "decode_count", "decode_seconds"]
+
+
+def label_value(value) -> str:
+    # escaping of a Prometheus label value
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class ScanMetrics:
+
+    def __init__(self, slowest: int = 10):
+        self.slowest_count = slowest
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+        self.kinds = {}
+        self.counters = {"writer_seconds": 0.0, "finalize_seconds": 0.0}
+        # min heap of (seconds, service url), only the slowest services are kept
+        self.slowest = []
+
+    def kind(self, kind: str) -> dict:
+        # callers hold the lock
+        stats = self.kinds.get(kind)
+        if stats is None:
+            stats = dict.fromkeys(KIND_COUNTERS, 0)
+            stats["buckets"] = [0] * (len(LATENCY_BUCKETS) + 1)
+            self.kinds[kind] = stats
+        return stats
+
+    def request(self, kind: str, seconds: float, size: int, error: bool = False):
+        bucket = len(LATENCY_BUCKETS)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                bucket = index
+                break
+        with self.lock:
+            stats = self.kind(kind)
+            stats["requests"] += 1
+            stats["errors"] += int(error)
+            stats["bytes"] += size
+            stats["latency_sum"] += seconds
+            stats["buckets"][bucket] += 1
+
+    def retry(self, kind: str):
+        with self.lock:
+            self.kind(kind)["retries"] += 1
+
+    def cache_hit(self, kind: str):
+        with self.lock:
+            self.kind(kind)["cache_hits"] += 1
+
+    def decode(self, kind: str, seconds: float):
+        with self.lock:
+            stats = self.kind(kind)
+            stats["decode_count"] += 1
+            stats["decode_seconds"] += seconds
+
+    def add(self, counter: str, value: float):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def service(self, service_url: str, seconds: float):
+        with self.lock:
+            entry = (seconds, service_url)
+            if len(self.slowest) < self.slowest_count:
+                heapq.heappush(self.slowest, entry)
+            elif entry > self.slowest[0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def state(self) -> dict:
+        """plain copy of everything collected, can be sent across processes and merged with merge()"""
+        with self.lock:
+            return json.loads(json.dumps({"kinds": self.kinds, "counters": self.counters, "slowest": self.slowest}))
+
+    def merge(self, state: dict):
+        for kind, other in state["kinds"].items():
+            with self.lock:
+                stats = self.kind(kind)
+                for name in KIND_COUNTERS:
+                    stats[name] += other[name]
+                stats["buckets"] = [a + b for a, b in zip(stats["buckets"], other["buckets"])]
+        for counter, value in state["counters"].items():
+            self.add(counter, value)
+        for seconds, service_url in state["slowest"]:
+            self.service(service_url, seconds)
+
+    def quantile(self, stats: dict, q: float):
+        # upper bound of the bucket holding the q quantile, None past the last bucket
+        target = q * stats["requests"]
+        seen = 0
+        for index, count in enumerate(stats["buckets"]):
+            seen += count
+            if seen >= target and count:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else None
+        return None
+
+    def report(self) -> dict:
+        state = self.state()
+        kinds = {}
+        for kind, stats in sorted(state["kinds"].items()):
+            kinds[kind] = {
+                name: stats[name] for name in KIND_COUNTERS
+            }
+            kinds[kind]["latency_buckets"] = {
+                str(bound): count for bound, count in zip(LATENCY_BUCKETS + ["+Inf"], stats["buckets"])
+            }
+            kinds[kind]["latency_p50"] = self.quantile(stats, 0.5)
+            kinds[kind]["latency_p95"] = self.quantile(stats, 0.95)
+        return {
+            "started": self.started,
+            "duration_seconds": time.time() - self.started,
+            "endpoints": kinds,
+            "counters": state["counters"],
+            "slowest_services": [
+                {"url": service_url, "seconds": round(seconds, 3)} for seconds, service_url in sorted(state["slowest"], reverse=True)
+            ],
+        }
+
+    def format_quantile(self, stats: dict, name: str) -> str:
+        bound = stats[f"latency_{name}"]
+        if bound is not None:
+            return f"{name}<={bound}s"
+        # no request sent (all cache hits), or slower than the last bucket
+        return f"{name}=-" if not stats["requests"] else f"{name}>{LATENCY_BUCKETS[-1]}s"
+
+    def log_summary(self):
+        report = self.report()
+        for kind, stats in report["endpoints"].items():
+            logging.info(
+                f"Metrics {kind}: requests={stats['requests']} errors={stats['errors']} retries={stats['retries']} "
+                f"cache_hits={stats['cache_hits']} MB={stats['bytes'] / (1024 * 1024):.1f} "
+                f"{self.format_quantile(stats, 'p50')} {self.format_quantile(stats, 'p95')} decode={stats['decode_seconds']:.2f}s"
+            )
+        counters = report["counters"]
+        logging.info(f"Metrics writer={counters['writer_seconds']:.2f}s finalize={counters['finalize_seconds']:.2f}s")
+        for service in report["slowest_services"][:3]:
+            logging.info(f"Metrics slow service: {service['seconds']}s {service['url']}")
+
+    def write(self, path: str):
+        """write the report, as a Prometheus textfile when path ends with .prom, as json otherwise"""
+        if path.endswith(".prom"):
+            text = self.prometheus(self.report())
+        else:
+            text = json.dumps(self.report(), indent=2)
+
+        # write then rename, a textfile collector must never read a partial file
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+        logging.info(f"Metrics report written to {path}")
+
+    def prometheus(self, report: dict) -> str:
+        lines = []
+
+        def metric(name: str, metric_type: str, help_text: str, samples: list):
+            lines.append(f"# HELP arcgis_scan_{name} {help_text}")
+            lines.append(f"# TYPE arcgis_scan_{name} {metric_type}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{key}="{label_value(label)}"' for key, label in labels)
+                lines.append(f"arcgis_scan_{name}{suffix}{{{label_text}}} {value}" if labels else f"arcgis_scan_{name}{suffix} {value}")
+
+        endpoints = report["endpoints"]
+        for name, counter, help_text in [
+            ("requests_total", "requests", "http requests sent, retries included"),
+            ("request_errors_total", "errors", "requests that failed or did not return 200/304"),
+            ("retries_total", "retries", "requests retried after throttling or an error"),
+            ("cache_hits_total", "cache_hits", "responses served from the cache without a request"),
+            ("response_bytes_total", "bytes", "response bytes received"),
+            ("json_decode_seconds_total", "decode_seconds", "time spent decoding json responses"),
+        ]:
+            metric(name, "counter", help_text, [("", [("kind", kind)], stats[counter]) for kind, stats in endpoints.items()])
+
+        samples = []
+        for kind, stats in endpoints.items():
+            cumulative = 0
+            for bound, count in stats["latency_buckets"].items():
+                cumulative += count
+                samples.append(("_bucket", [("kind", kind), ("le", bound)], cumulative))
+            samples.append(("_sum", [("kind", kind)], stats["latency_sum"]))
+            samples.append(("_count", [("kind", kind)], stats["requests"]))
+        metric("request_seconds", "histogram", "latency of the http requests", samples)
+
+        for counter, value in sorted(report["counters"].items()):
+            metric(counter, "gauge", counter.replace("_", " "), [("", [], value)])
+        metric("duration_seconds", "gauge", "wall time of the scan", [("", [], report["duration_seconds"])])
+        metric(
+            "slowest_service_seconds",
+            "gauge",
+            "fetch time of the slowest services",
+            [("", [("url", service["url"])], service["seconds"]) for service in report["slowest_services"]],
+        )
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,176 @@
+"""
+File: scan_state.py
+Version: 1.4
+
+Description:
+State kept between scans of the same ArcGIS server, and within one long scan.
+
+DeltaState is the state file of an incremental scan. It maps each service externalId to
+    quick        edit dates of the editingInfo of the service document, when the server provides them
+    fingerprint  sha1 of the service and layer documents (layer documents include the fields)
+    layers       externalIds of the layers of the service
+    type         FeatureServer / MapServer, to know the class of a deleted service
+
+On the next scan a service with the same quick key is skipped before its layers are fetched, a service
+with the same fingerprint is not written again. Services and layers that disappeared are reported
+as deleted.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+
+class DeltaState:
+
+    STATE_VERSION = 1
+
+    def __init__(self, path: str):
+        self.path = path
+        self.previous = {}
+        self.current = {}
+        self.listed = set()
+
+        self.new = 0
+        self.changed = 0
+        self.unchanged = 0
+
+        if os.path.exists(path):
+            with open(path, encoding="utf8") as f:
+                state = json.load(f)
+            if state.get("version") == self.STATE_VERSION:
+                self.previous = state["services"]
+            else:
+                logging.warning(f"delta state {path} has an unknown version, running a full scan")
+
+        logging.info(f"Delta scan: {len(self.previous)} services known from the previous scan")
+
+    def quick_key(self, service_obj: dict):
+        """change marker published by the server for the whole service, or None if there is none"""
+        # the serviceItemId names the portal item and stays the same when the service is edited, it proves nothing
+        editing_info = service_obj.get("editingInfo")
+        if not isinstance(editing_info, dict):
+            return None
+        dates = {key: editing_info[key] for key in ("lastEditDate", "dataLastEditDate", "schemaLastEditDate") if editing_info.get(key)}
+        if not dates:
+            return None
+        return json.dumps(dates, sort_keys=True)
+
+    def fingerprint(self, service_obj: dict, layers: list) -> str:
+        digest = hashlib.sha1(json.dumps(service_obj, sort_keys=True).encode("utf8"))
+        for layer_ref, layer_obj in layers:
+            digest.update(json.dumps(layer_obj, sort_keys=True).encode("utf8"))
+        return digest.hexdigest()
+
+    def list_service(self, external_id: str):
+        # the service is still on the server, even if this scan does not get to read it
+        self.listed.add(external_id)
+
+    def list_prefix(self, prefix: str):
+        # a folder could not be read, its services may still be on the server and are not reported as deleted
+        self.listed.update(external_id for external_id in self.previous if external_id.startswith(prefix))
+
+    def unchanged_before_layers(self, external_id: str, service_obj: dict) -> bool:
+        quick = self.quick_key(service_obj)
+        previous = self.previous.get(external_id)
+        return quick is not None and previous is not None and previous.get("quick") == quick
+
+    def keep(self, external_id: str):
+        self.unchanged += 1
+        self.current[external_id] = self.previous[external_id]
+
+    def record(self, external_id: str, service_type: str, service_obj: dict, layers: list, layer_ids: list) -> bool:
+        """remember the service as read by this scan, returns True if it has to be written"""
+        fingerprint = self.fingerprint(service_obj, layers)
+        self.current[external_id] = {
+            "quick": self.quick_key(service_obj),
+            "fingerprint": fingerprint,
+            "layers": layer_ids,
+            "type": service_type,
+        }
+
+        previous = self.previous.get(external_id)
+        if previous is None:
+            self.new += 1
+            return True
+        if previous["fingerprint"] != fingerprint:
+            self.changed += 1
+            return True
+        self.unchanged += 1
+        return False
+
+    def deleted_layers(self, external_id: str) -> list:
+        previous = self.previous.get(external_id)
+        if previous is None:
+            return []
+        current = set(self.current[external_id]["layers"])
+        return [layer_id for layer_id in previous["layers"] if layer_id not in current]
+
+    def deleted_services(self) -> list:
+        """services of the previous scan that are not listed by the server anymore, as (externalId, state)"""
+        return [(external_id, entry) for external_id, entry in self.previous.items() if external_id not in self.listed]
+
+    def checkpoint_state(self) -> dict:
+        return {
+            "current": self.current,
+            "listed": sorted(self.listed),
+            "counts": [self.new, self.changed, self.unchanged],
+        }
+
+    def restore_state(self, state: dict):
+        self.current = state["current"]
+        self.listed = set(state["listed"])
+        self.new, self.changed, self.unchanged = state["counts"]
+
+    def save(self):
+        # services that were listed but not read this time (limit, failed requests) keep their previous state
+        for external_id in self.listed:
+            if external_id not in self.current and external_id in self.previous:
+                self.current[external_id] = self.previous[external_id]
+
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf8") as f:
+            json.dump({"version": self.STATE_VERSION, "services": self.current}, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+        logging.info(
+            f"Delta scan: new={self.new} changed={self.changed} unchanged={self.unchanged} "
+            f"deleted={len(self.deleted_services())} state={self.path}"
+        )
+
+
+class Checkpoint:
+    """
+    Periodic checkpoint of a scan, saved in its own folder:
+        checkpoint.json  the crawl frontier, how far the scan got, crawler/writer/delta counters
+        rows.jsonl       journal of every row the writer produced, replayed on resume up to the checkpoint
+    Both files are removed when the scan finishes.
+    """
+
+    def __init__(self, folder: str, every: int = 25):
+        self.folder = folder
+        self.every = max(1, every)
+        self.state_path = os.path.join(folder, "checkpoint.json")
+        self.journal_path = os.path.join(folder, "rows.jsonl")
+
+        os.makedirs(folder, exist_ok=True)
+
+    def load(self):
+        if not os.path.exists(self.state_path) or not os.path.exists(self.journal_path):
+            return None
+        with open(self.state_path, encoding="utf8") as f:
+            return json.load(f)
+
+    def save(self, state: dict):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf8") as f:
+            json.dump(state, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.state_path)
+
+    def clear(self):
+        for path in (self.state_path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,58 @@
+import copy
+import os
+import tempfile
+import unittest
+
+from scan_state import DeltaState
+
+SERVICE_ID = "arcgis/Parcels"
+
+
+def service_doc(**extra) -> dict:
+    return {"serviceDescription": "Parcels", "layers": [{"id": 0, "name": "Parcels"}], **extra}
+
+
+def layer_doc(field_names: list) -> dict:
+    return {"id": 0, "name": "Parcels", "fields": [{"name": name, "type": "esriFieldTypeString"} for name in field_names]}
+
+
+class DeltaStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "delta.json")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def scan(self, service_obj: dict, layer_obj: dict) -> tuple:
+        """one incremental scan of the service, returns (skipped before its layers, written)"""
+        delta = DeltaState(self.path)
+        delta.list_service(SERVICE_ID)
+        if delta.unchanged_before_layers(SERVICE_ID, service_obj):
+            delta.keep(SERVICE_ID)
+            delta.save()
+            return True, False
+        layers = [({"id": 0}, layer_obj)]
+        written = delta.record(SERVICE_ID, "MapServer", service_obj, layers, [SERVICE_ID + "/0"])
+        delta.save()
+        return False, written
+
+    def test_service_item_id_alone_does_not_skip_the_layers(self):
+        # a federated MapServer or hosted view: a portal item, but no editingInfo
+        service_obj = service_doc(serviceItemId="0123456789abcdef")
+        self.assertEqual(self.scan(service_obj, layer_doc(["OBJECTID", "OWNER"])), (False, True))
+        self.assertEqual(self.scan(copy.deepcopy(service_obj), layer_doc(["OBJECTID", "OWNER"])), (False, False))
+        self.assertEqual(self.scan(copy.deepcopy(service_obj), layer_doc(["OBJECTID", "OWNER", "ZONING"])), (False, True))
+
+    def test_same_edit_dates_skip_the_layers(self):
+        service_obj = service_doc(serviceItemId="0123456789abcdef", editingInfo={"lastEditDate": 1700000000000})
+        self.assertEqual(self.scan(service_obj, layer_doc(["OBJECTID"])), (False, True))
+        self.assertEqual(self.scan(copy.deepcopy(service_obj), layer_doc(["OBJECTID"])), (True, False))
+
+        service_obj["editingInfo"]["lastEditDate"] += 1
+        self.assertEqual(self.scan(service_obj, layer_doc(["OBJECTID", "OWNER"])), (False, True))
+
+
+if __name__ == "__main__":
+    unittest.main()
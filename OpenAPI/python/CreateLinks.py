@@ -1,5 +1,5 @@
+import csv
 import json
-import pandas as pd
 import argparse
 import os
 import jsonref
@@ -24,11 +24,11 @@ Note: Run the this script first, so it's output file will be included in the zip
 
 Requirements:
 - Python 3.x
-- pandas
 - jsonref
 
 Changelog:
 - v1.0: Initial release
+- v1.1: Write links.csv with the csv module instead of pandas
 
 """
 
@@ -147,11 +147,11 @@ def generate_links_csv(openapi_json_path, output_csv_path):
                 method_link = source_path + "~" + parameter['name']
                 relationships.append([source_path, method_link, modelClass + ".ParameterGroupToParameter"])
 
-    # Create DataFrame from all relationships
-    df_links = pd.DataFrame(relationships, columns=["Source", "Target", "Association"])
-
     # Save the CSV file in the provided format
-    df_links.to_csv(output_csv_path, index=False)
+    with open(output_csv_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file, lineterminator=os.linesep)
+        writer.writerow(["Source", "Target", "Association"])
+        writer.writerows(relationships)
     print(f"CSV file generated successfully: {output_csv_path}")
 
 
@@ -194,4 +194,4 @@ if __name__ == "__main__":
         print(f"Error: The file '{args.json_file}' does not exist.")
         exit(1)
 
-    generate_links_csv(args.json_file, "data\links.csv")
+    generate_links_csv(args.json_file, os.path.join("data", "links.csv"))
@@ -1,6 +1,9 @@
+import csv
+import functools
+import io
 import json
-import pandas as pd
 import os
+import time
 import zipfile
 import argparse
 import os
@@ -26,15 +29,80 @@ Note: Run the CreateLinks.py script first, so it's output file will be included
 
 Requirements:
 - Python 3.x
-- pandas
 - jsonref
 
 Changelog:
 - v1.0: Initial release
+- v1.1: Zip only the files of this run, optionally write them straight into the zip (--no-csv)
+- v1.2: Write the csv files with the csv module instead of pandas, columns in the order of the model
 
 """
 modelClass = "custom.openapi"
 
+output_dir = "data"
+
+model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model", "openAPIModel.json")
+
+# written first in every class file, the model attributes of the class follow
+core_columns = [
+    "core.externalId",
+    "core.name",
+    "core.description",
+    "core.businessDescription",
+    "core.businessName",
+    "core.reference",
+]
+
+# csv files produced by this run, {file name: (columns, rows)}. Only these (plus links.csv) go into the zip file
+outputs = {}
+
+# False: the csv files are only written into the zip file, not into output_dir
+write_csv_files = True
+
+
+@functools.lru_cache(maxsize=None)
+def model_columns():
+    """columns of each class of the model, {class name: core columns + attributes of the class in model order}"""
+    columns = {}
+    if not os.path.exists(model_path):
+        print(f"Warning: model {model_path} not found, the columns are taken from the rows")
+        return columns
+    with open(model_path, "r", encoding="utf-8") as file:
+        model = json.load(file)
+    for class_attribute in model.get("classAttributes", []):
+        columns.setdefault(class_attribute["className"], list(core_columns)).append(class_attribute["attributeName"])
+    return columns
+
+
+def output_columns(rows, class_name):
+    """the core columns, the model attributes of the class the rows have, in model order, then any other attribute of the rows"""
+    keys = {}
+    for row in rows:
+        keys.update(dict.fromkeys(row))
+    columns = list(core_columns)
+    columns += [column for column in model_columns().get(class_name, core_columns) if column in keys and column not in columns]
+    columns += [key for key in keys if key not in columns]
+    return columns
+
+
+def write_csv(file, columns, rows):
+    # os.linesep line ends and None written as an empty value, like the pandas output of earlier versions
+    writer = csv.DictWriter(file, fieldnames=columns, lineterminator=os.linesep)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def write_output(rows, file_name):
+    columns = output_columns(rows, os.path.splitext(file_name)[0])
+    outputs[file_name] = (columns, rows)
+
+    if write_csv_files:
+        os.makedirs(output_dir, exist_ok=True)
+        output_csv = os.path.join(output_dir, file_name)
+        with open(output_csv, "w", newline="", encoding="utf-8") as file:
+            write_csv(file, columns, rows)
+        print(f"CSV file created: {output_csv}")
+
 def extract_info_section(json_file):
     with open(json_file, "r", encoding="utf-8") as file:
         data = json.load(file)
@@ -63,12 +131,7 @@ def extract_info_section(json_file):
         modelClass + ".Version": info.get("version", "")
     }
 
-    df = pd.DataFrame([petstore_info])
-    output_dir = "data"
-    os.makedirs(output_dir, exist_ok=True)
-    output_csv = os.path.join(output_dir, modelClass + ".Info.csv")
-    df.to_csv(output_csv, index=False)
-    print(f"CSV file created: {output_csv}")
+    write_output([petstore_info], modelClass + ".Info.csv")
 
     return core_external_id  # Return the generated core.externalId
 
@@ -113,12 +176,7 @@ def extract_tags_section(json_file, core_external_id):
                 tag_tracking.append(tag_external_id)
                 tags_data.append(tag_entry)
 
-    df = pd.DataFrame(tags_data)
-    output_dir = "data"
-    os.makedirs(output_dir, exist_ok=True)
-    output_csv = os.path.join(output_dir, modelClass + ".Tag.csv")
-    df.to_csv(output_csv, index=False)
-    print(f"CSV file created: {output_csv}")
+    write_output(tags_data, modelClass + ".Tag.csv")
 
 
 def extract_endpoints_section(json_file, core_external_id):
@@ -142,12 +200,7 @@ def extract_endpoints_section(json_file, core_external_id):
             if endpoint_entry not in endpoints_data:
                 endpoints_data.append(endpoint_entry)
 
-    df = pd.DataFrame(endpoints_data)
-    output_dir = "data"
-    os.makedirs(output_dir, exist_ok=True)
-    output_csv = os.path.join(output_dir, modelClass + ".Endpoint.csv")
-    df.to_csv(output_csv, index=False)
-    print(f"CSV file created: {output_csv}")
+    write_output(endpoints_data, modelClass + ".Endpoint.csv")
 
 
 def extract_methods_section(json_file, core_external_id):
@@ -173,12 +226,7 @@ def extract_methods_section(json_file, core_external_id):
             if endpoint_entry not in endpoints_data:
                 endpoints_data.append(endpoint_entry)
 
-    df = pd.DataFrame(endpoints_data)
-    output_dir = "data"
-    os.makedirs(output_dir, exist_ok=True)
-    output_csv = os.path.join(output_dir, modelClass + ".Method.csv")
-    df.to_csv(output_csv, index=False)
-    print(f"CSV file created: {output_csv}")
+    write_output(endpoints_data, modelClass + ".Method.csv")
 
 
 def create_response_stubs(json_file, core_external_id):
@@ -203,12 +251,7 @@ def create_response_stubs(json_file, core_external_id):
             if endpoint_entry not in response_data:
                 response_data.append(endpoint_entry)
 
-    df = pd.DataFrame(response_data)
-    output_dir = "data"
-    os.makedirs(output_dir, exist_ok=True)
-    output_csv = os.path.join(output_dir, modelClass + ".ResponseGroup.csv")
-    df.to_csv(output_csv, index=False)
-    print(f"CSV file created: {output_csv}")
+    write_output(response_data, modelClass + ".ResponseGroup.csv")
 
 
 def create_responses(json_file, core_external_id):
@@ -234,12 +277,7 @@ def create_responses(json_file, core_external_id):
                 if endpoint_entry not in response_data:
                     response_data.append(endpoint_entry)
 
-    df = pd.DataFrame(response_data)
-    output_dir = "data"
-    os.makedirs(output_dir, exist_ok=True)
-    output_csv = os.path.join(output_dir, modelClass + ".Response.csv")
-    df.to_csv(output_csv, index=False)
-    print(f"CSV file created: {output_csv}")
+    write_output(response_data, modelClass + ".Response.csv")
 
 
 def create_response_fields(json_file, core_external_id):
@@ -332,12 +370,7 @@ def create_response_fields(json_file, core_external_id):
                                         if endpoint_entry not in response_data:
                                             response_data.append(endpoint_entry)
 
-    df = pd.DataFrame(response_data)
-    output_dir = "data"
-    os.makedirs(output_dir, exist_ok=True)
-    output_csv = os.path.join(output_dir, modelClass + ".ResponseField.csv")
-    df.to_csv(output_csv, index=False)
-    print(f"CSV file created: {output_csv}")
+    write_output(response_data, modelClass + ".ResponseField.csv")
 
 
 def create_parameter_stubs(json_file, core_external_id):
@@ -364,12 +397,7 @@ def create_parameter_stubs(json_file, core_external_id):
                 if endpoint_entry not in response_data:
                     response_data.append(endpoint_entry)
 
-    df = pd.DataFrame(response_data)
-    output_dir = "data"
-    os.makedirs(output_dir, exist_ok=True)
-    output_csv = os.path.join(output_dir, modelClass + ".ParameterGroup.csv")
-    df.to_csv(output_csv, index=False)
-    print(f"CSV file created: {output_csv}")
+    write_output(response_data, modelClass + ".ParameterGroup.csv")
 
 
 def create_parameters(json_file, core_external_id):
@@ -402,22 +430,28 @@ def create_parameters(json_file, core_external_id):
                     if endpoint_entry not in parameter_data:
                         parameter_data.append(endpoint_entry)
 
-    df = pd.DataFrame(parameter_data)
-    output_dir = "data"
-    os.makedirs(output_dir, exist_ok=True)
-    output_csv = os.path.join(output_dir, modelClass + ".Parameter.csv")
-    df.to_csv(output_csv, index=False)
-    print(f"CSV file created: {output_csv}")
+    write_output(parameter_data, modelClass + ".Parameter.csv")
 
 
-def create_zip_file(json_file):
+def create_zip_file(json_file, compresslevel=None):
     base_name = os.path.splitext(os.path.basename(json_file))[0]
     zip_filename = f"{base_name}.zip"
 
-    with zipfile.ZipFile(zip_filename, 'w') as zipf:
-        for root, _, files in os.walk("data"):
-            for file in files:
-                zipf.write(os.path.join(root, file), arcname=file)
+    with zipfile.ZipFile(zip_filename, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zipf:
+        # links.csv is written by CreateLinks.py, run before this script
+        links_csv = os.path.join(output_dir, "links.csv")
+        if os.path.exists(links_csv):
+            zipf.write(links_csv, arcname="links.csv")
+        else:
+            print(f"Warning: {links_csv} not found, run CreateLinks.py first to include the links")
+
+        for file_name, (columns, rows) in outputs.items():
+            member = io.StringIO(newline="")
+            write_csv(member, columns, rows)
+            # dated now, zipfile dates a member written by name 1980-01-01
+            info = zipfile.ZipInfo(file_name, time.localtime()[:6])
+            info.external_attr = 0o644 << 16
+            zipf.writestr(info, member.getvalue(), compress_type=zipf.compression, compresslevel=zipf.compresslevel)
     print(f"ZIP file created: {zip_filename}")
 
 
@@ -448,14 +482,18 @@ def flatten_json(json_obj, parent_key='', sep='->'):
 
 if __name__ == "__main__":
 
-    # Ensure 'data' directory exists
-    os.makedirs('data', exist_ok=True)
-
     parser = argparse.ArgumentParser(description="Process an OpenAPI JSON file to generate output files.")
     parser.add_argument("json_file", help="Path to the OpenAPI JSON file")
+    parser.add_argument("--no-csv", action="store_true", help="only write the csv files into the zip file, not into the data folder")
+    parser.add_argument("--compression-level", type=int, choices=range(0, 10), metavar="0-9", help="DEFLATE compression level of the zip file")
 
     args = parser.parse_args()
 
+    write_csv_files = not args.no_csv
+    if write_csv_files:
+        # Ensure 'data' directory exists
+        os.makedirs(output_dir, exist_ok=True)
+
     core_external_id = extract_info_section(args.json_file)
     extract_tags_section(args.json_file, core_external_id)
     extract_endpoints_section(args.json_file, core_external_id)
@@ -468,4 +506,4 @@ if __name__ == "__main__":
     create_responses(args.json_file, core_external_id)
     create_response_fields(args.json_file, core_external_id)
 
-    create_zip_file(args.json_file)
+    create_zip_file(args.json_file, args.compression_level)